@@ -81,6 +81,13 @@ void loop() {
         Serial.println("ESP-NOW not initialized.");
       }
     } else {
+      // "A<angleX>,<angleY>" carries servo angles already computed by the host,
+      // plain "<x>,<y>" carries pixel coordinates of a 640x480 frame
+      bool anglesGiven = input.startsWith("A");
+      if (anglesGiven) {
+        input = input.substring(1);
+      }
+
       // Parse the input for X and Y coordinates
       int commaIndex = input.indexOf(',');
       if (commaIndex > 0) {
@@ -92,8 +99,8 @@ void loop() {
         int y = yString.toInt();
 
         // Map coordinates to servo angles
-        int angleX = map(x, 0, screenWidth, minAngle, maxAngle);
-        int angleY = map(y, 0, screenHeight, 52, 148);
+        int angleX = anglesGiven ? constrain(x, minAngle, maxAngle) : map(x, 0, screenWidth, minAngle, maxAngle);
+        int angleY = anglesGiven ? constrain(y, 52, 148) : map(y, 0, screenHeight, 52, 148);
 
         // Write angles to servos
         servoX.write(angleX);
@@ -1,41 +1,39 @@
 import os
 import sys
 import cv2
-from ultralytics import YOLO
 
 sys.path.append(os.path.abspath(".."))
 
-from supporting.camera_output import capture_one_frame
+from supporting.frame_source import open_source
+from supporting.model_registry import get_model
+from supporting.detections import detect
 
 #model_path = os.path.join('.', 'runs', 'detect', 'train', 'weights', 'last.pt')
-model = YOLO('june8.pt') 
+model = get_model('june8.pt')
 
 threshold = 0
 stackx = []
 stacky = []
 
-# Load an image
-frame = capture_one_frame()
+# Load an image from the camera, or from the video/image folder given on the command line
+source = open_source(sys.argv[1] if len(sys.argv) > 1 else "0")
+latest = source.read()
+source.close()
+if latest is None:
+    sys.exit("No frame available")
+frame = latest[2].copy()
 
-# Predict the image
-results = model(frame)[0]
 print("Is the stacks empty?", len(stackx) == 0 and len(stacky) == 0 )  # Output: True
 
-for result in results.boxes.data.tolist():
-    x1, y1, x2, y2, score, class_id = result
-    detection_color= (0, 255, 0) if int(class_id)==0 else (0, 0, 255)
-    if score > threshold:
-        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), detection_color, 4)
-        cv2.putText(frame, results.names[int(class_id)].upper(), (int(x1), int(y1 - 10)),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1.3, detection_color, 3, cv2.LINE_AA)
-        print('cordinates',x1,y1,x2,y2)
-
-        #calculating the scaling constant
-        x=int((x1+x2)//2)
-        y=int((y1+y2)//2)
-        # Push elements to the stack
-        stackx.append(x)
-        stacky.append(y)
+# Predict the image
+detections = detect(model, frame, threshold)
+detections.draw(frame, {0: (0, 255, 0), 1: (0, 0, 255)}, thickness=4, font_scale=1.3, label_score=False)
+for x1, y1, x2, y2 in detections.xyxy.tolist():
+    print('cordinates',x1,y1,x2,y2)
+
+# Push all centroids to the stacks
+stackx.extend(detections.centroid[:, 0].tolist())
+stacky.extend(detections.centroid[:, 1].tolist())
 
 # Display the image with predictions
 # Print the entire stack
@@ -1,16 +1,18 @@
 import sys
-import cv2
 import serial
 import psutil
-from ultralytics import YOLO
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QSlider,
     QComboBox, QPushButton, QCheckBox, QLineEdit, QGroupBox, QMessageBox
 )
 from PyQt5.QtGui import QPixmap, QImage, QIcon
 from PyQt5.QtCore import Qt, QTimer, QThread, pyqtSignal
-from supporting.camera_output import capture_one_frame
+from supporting.camera_output import release_cameras
+from supporting.inference_pool import InferencePool, AsyncDetector
+from supporting.frame_source import CameraSource, open_source
 from supporting.circular_progress_bar import CircularProgressBar
+from supporting.buffer_pool import BufferPool, bgr_to_rgb, copy_into
+from supporting.tracker import Tracker
 import serial.tools.list_ports
 import os
 
@@ -26,62 +28,54 @@ class FrameProcessor(QThread):
     frame_processed = pyqtSignal(QImage)  # Signal for processed frame
     coordinates_processed = pyqtSignal(list)  # Signal for detected coordinates
 
-    def __init__(self, model, parent=None):
+    def __init__(self, inference, source=None, parent=None):
         super(FrameProcessor, self).__init__(parent)
-        self.model = model
+        self.inference = inference
+        self.source = source or CameraSource(0)
+        # Buffers are reused every frame, so the pool belongs to this thread only
+        self.pool = BufferPool()
+        # The model runs in the pool's worker processes on every third frame, the tracker follows
+        # the plants in between, so this thread never waits for an inference
+        self.tracker = Tracker(AsyncDetector(inference), detect_every=3)
         self.running = True
 
     def run(self):
-        while self.running:
-            frame = capture_one_frame()
+        while self.running and not self.source.is_finished():
+            # Block until the source has a frame we have not processed yet
+            latest = self.source.read(timeout=1.0)
+            if latest is None:
+                continue
+            _, timestamp, frame = latest
             if frame is not None and frame.size != 0:
-                coordinates, annotated_frame = self.process_image_with_yolo(frame)
+                detections = self.tracker.step(frame, timestamp)
+                annotated_frame = self.tracker.draw_ids(detections.draw(copy_into(self.pool, "annotated", frame)))
 
                 # Convert processed frame to QImage for display
-                rgb_image = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
+                rgb_image = bgr_to_rgb(self.pool, annotated_frame)
                 height, width, channel = rgb_image.shape
                 bytes_per_line = channel * width
-                qimage = QImage(rgb_image.data, width, height, bytes_per_line, QImage.Format_RGB888)
+                # The GUI thread paints it later, so hand over a copy instead of the reused buffer
+                qimage = QImage(rgb_image.data, width, height, bytes_per_line, QImage.Format_RGB888).copy()
 
                 # Emit the processed frame and coordinates
                 self.frame_processed.emit(qimage)
-                self.coordinates_processed.emit(coordinates)
+                self.coordinates_processed.emit(detections.centroid.tolist())
 
     def stop(self):
         self.running = False
 
-    def process_image_with_yolo(self, image):
-        results = self.model(image)[0]
-        coordinates = []
-        annotated_frame = image.copy()
-
-        for obj in results.boxes.data.tolist():
-            x1, y1, x2, y2, score, class_id = obj
-            x = int((x1 + x2) // 2)
-            y = int((y1 + y2) // 2)
-            coordinates.append((x, y))
-
-            # Draw bounding box and label
-            label = f"{self.model.names[int(class_id)]}: {score:.2f}"
-            cv2.rectangle(annotated_frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-            cv2.putText(
-                annotated_frame, label, (int(x1), int(y1) - 10),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-            )
-        return coordinates, annotated_frame
-
 
 # Main GUI Class
 class USRControlSoftware(QWidget):
-    def __init__(self):
+    def __init__(self, source=None):
         super().__init__()
         self.stackx = []
         self.stacky = []
         self.esp = None
 
-        # Load YOLO model
+        # Load YOLO model in the inference worker processes
         try:
-            self.model = YOLO('june8.pt')
+            self.inference = InferencePool('june8.pt')
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load YOLO model: {e}")
             sys.exit(1)
@@ -90,7 +84,7 @@ class USRControlSoftware(QWidget):
         self.initSerial()
 
         # Create FrameProcessor Thread
-        self.processor = FrameProcessor(self.model)
+        self.processor = FrameProcessor(self.inference, source)
         self.processor.frame_processed.connect(self.update_frame_display)
         self.processor.coordinates_processed.connect(self.update_coordinates)
         self.processor.start()
@@ -210,6 +204,12 @@ class USRControlSoftware(QWidget):
     def closeEvent(self, event):
         self.processor.stop()
         self.processor.wait()
+        self.processor.source.close()
+        print(self.processor.pool.report())
+        print(self.processor.tracker.summary())
+        self.inference.close()
+        print(self.inference.summary())
+        release_cameras()
         if self.esp and self.esp.is_open:
             self.esp.close()
         event.accept()
@@ -217,6 +217,8 @@ class USRControlSoftware(QWidget):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = USRControlSoftware()
+    # Optional camera index, video file or image folder to run on instead of camera 0
+    source = open_source(sys.argv[1], realtime=True) if len(sys.argv) > 1 else None
+    window = USRControlSoftware(source)
     window.show()
     sys.exit(app.exec_())
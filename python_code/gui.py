@@ -1,46 +1,48 @@
 import sys
-import cv2
 import time
 import serial
-from ultralytics import YOLO
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QSlider, 
     QComboBox, QPushButton, QCheckBox, QLineEdit, QGroupBox
 )
 from PyQt5.QtGui import QPixmap, QColor,QIcon,QImage
 from PyQt5.QtCore import Qt,QTimer
-from supporting.camera_output import capture_one_frame
+from supporting.camera_output import release_cameras
+from supporting.frame_source import CameraSource, open_source
 from supporting.circular_progress_bar import CircularProgressBar
+from supporting.buffer_pool import BufferPool, bgr_to_rgb, copy_into
+from supporting.image_adjust import ImageAdjuster, zoom_crop
+from supporting.targeting import TargetingModel, angle_message
+from supporting.work_area import WorkArea
+from supporting.detections import Detections
+from supporting.scene_change import SceneChangeDetector
+from supporting.tracker import Tracker
+from supporting.inference_pool import InferencePool, AsyncDetector
 
-#Initialize stacks and YOLO model
+#Initialize stacks, the model and serial port are opened under __main__ below
 stackx = []
 stacky = []
-model = YOLO('june8.pt')
-esp = serial.Serial('COM11', 9600, timeout=1)  # Replace 'COM_PORT' with the actual ESP8266 port
-
-def process_image_with_yolo(image):
-    results = model(image)[0]
-    coordinates = []
-    annotated_frame = image.copy()
-
-    for obj in results.boxes.data.tolist():
-        x1, y1, x2, y2, score, class_id = obj
-        x = int((x1 + x2) // 2)
-        y = int((y1 + y2) // 2)
-        coordinates.append((x, y))
-
-        # Draw bounding box and label
-        label = f"{model.names[int(class_id)]}: {score:.2f}"
-        cv2.rectangle(annotated_frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-        cv2.putText(
-            annotated_frame, label, (int(x1), int(y1) - 10),
-            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2
-        )
-    return coordinates, annotated_frame
 
 class USRControlSoftware(QWidget):
-    def __init__(self):
+    def __init__(self, inference, source=None):
         super().__init__()
+        # Live camera by default, or a recording passed in for offline runs
+        self.source = source or CameraSource(0)
+        # Sliders go to the camera when it supports them, replayed frames are adjusted in software
+        self.adjuster = ImageAdjuster(getattr(self.source, "camera", None))
+        # Scratch buffers for the per-frame images, reused instead of allocated every tick
+        self.pool = BufferPool()
+        # Pixel to servo angle lookup table, fitted with supporting/targeting.py
+        self.targeting = TargetingModel.load().build_lut()
+        # Part of the frame the turret can reach, set from the Set Area panel
+        self.work_area = WorkArea.load()
+        # While the robot stands still the last detections are reused instead of running the model
+        self.scene = SceneChangeDetector()
+        # The model runs in worker processes, this thread only hands them frames and never waits
+        self.inference = inference
+        self.detector = AsyncDetector(inference)
+        # The model runs on every third frame, the tracker follows the plants in between
+        self.tracker = Tracker(lambda image: self.scene.run(self.detector, image), detect_every=3)
         self.initUI()
     
     def initUI(self):
@@ -149,15 +151,15 @@ class USRControlSoftware(QWidget):
         set_area_layout.setSpacing(10)
         
         height_label = QLabel("Height")
-        height_input = QLineEdit("0")
-        height_input.setFixedSize(60, 20)
+        self.height_input = QLineEdit(str(self.work_area.height))
+        self.height_input.setFixedSize(60, 20)
         height_button = QPushButton("OK")
         height_button.setFixedSize(50, 25)
         height_button.setStyleSheet("background-color: green; color: white;")
         
         width_label = QLabel("Width")
-        width_input = QLineEdit("0")
-        width_input.setFixedSize(60, 20)
+        self.width_input = QLineEdit(str(self.work_area.width))
+        self.width_input.setFixedSize(60, 20)
         width_button = QPushButton("Close")
         width_button.setFixedSize(50, 25)
         width_button.setStyleSheet("background-color: orange; color: white;")
@@ -165,18 +167,20 @@ class USRControlSoftware(QWidget):
         height_layout = QVBoxLayout()
         height_layout.setSpacing(5)
         height_layout.addWidget(height_label)
-        height_layout.addWidget(height_input)
+        height_layout.addWidget(self.height_input)
         height_layout.addWidget(height_button)
         
         width_layout = QVBoxLayout()
         width_layout.setSpacing(5)
         width_layout.addWidget(width_label)
-        width_layout.addWidget(width_input)
+        width_layout.addWidget(self.width_input)
         width_layout.addWidget(width_button)
         
         set_area_layout.addLayout(height_layout)
         set_area_layout.addLayout(width_layout)
         set_area_group.setLayout(set_area_layout)
+        height_button.clicked.connect(self.apply_work_area)
+        width_button.clicked.connect(self.clear_work_area)
         
         # Target Class to Spray
         target_group = QGroupBox("Set Target Class to Spray")
@@ -279,63 +283,114 @@ class USRControlSoftware(QWidget):
     def update_brightness_label(self):
         brightness_value = self.brightness_slider.value()
         self.brightness_slider_label.setText(f"Brightness: {brightness_value}")
+        self.adjuster.set_brightness(brightness_value)
 
     def update_saturation_label(self):
         saturation_value = self.saturation_slider.value()
         self.saturation_slider_label.setText(f"Saturation: {saturation_value}")
+        self.adjuster.set_saturation(saturation_value)
+
+    def apply_work_area(self):
+        # Height and width in pixels of a 640x480 frame, 0 keeps the full frame in that direction
+        try:
+            height, width = int(self.height_input.text()), int(self.width_input.text())
+        except ValueError:
+            print("Set Area: height and width must be whole numbers of pixels")
+            return
+        self.work_area = WorkArea(max(width, 0), max(height, 0), self.work_area.polygon)
+        self.work_area.save()
+        self.scene.reset()
+        self.tracker.reset()
+        print(f"Work area set to {self.work_area.width}x{self.work_area.height}")
+
+    def clear_work_area(self):
+        self.height_input.setText("0")
+        self.width_input.setText("0")
+        self.work_area = WorkArea()
+        self.work_area.save()
+        self.scene.reset()
+        self.tracker.reset()
+        print("Work area cleared, detecting on the full frame")
 
     def update_frame(self):
         global stackx, stacky
 
-        # Capture a frame
-        frame = capture_one_frame()
+        # Take the next frame without blocking, skip the tick if nothing new arrived
+        latest = self.source.read(timeout=0)
+        if latest is None:
+            return
+        _, timestamp, frame = latest
         if frame is None or frame.size == 0:
             print("Warning: Captured frame is empty.")
             return
 
         # Apply brightness and saturation adjustments
-        brightness = self.brightness_slider.value()
-        saturation = self.saturation_slider.value()
-        frame = cv2.convertScaleAbs(frame, alpha=saturation / 50, beta=brightness - 50)
+        frame = self.adjuster.apply(frame, self.pool)
 
-        # Zoom effect
-        zoom_factor = self.zoom_slider.value()
-        if zoom_factor > 1:
-            height, width, _ = frame.shape
-            center_x, center_y = width // 2, height // 2
-            radius_x, radius_y = width // (2 * zoom_factor), height // (2 * zoom_factor)
-            frame = frame[center_y - radius_y:center_y + radius_y, center_x - radius_x:center_x + radius_x]
-            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
+        # Only the reachable area is sent to the model, then the zoom crop is taken from it
+        area, (ax, ay) = self.work_area.crop(frame, self.pool)
+        zoomed, (zx, zy) = zoom_crop(area, self.zoom_slider.value())
+        x0, y0 = ax + zx, ay + zy
 
-        # YOLO Processing and stack update
-        coordinates, annotated_frame = process_image_with_yolo(frame)
+        # YOLO Processing and stack update, with positions mapped back to the full frame for the ESP8266
+        if zoomed.size:
+            detections = self.tracker.step(zoomed, timestamp)
+            annotated_frame = self.tracker.draw_ids(detections.draw(copy_into(self.pool, "annotated", zoomed)))
+        else:
+            # The Set Area rectangle and polygon do not overlap, there is nothing to detect on
+            detections = Detections.empty()
+            annotated_frame = self.work_area.draw(copy_into(self.pool, "annotated", frame))
+        height, width = frame.shape[:2]
+        detections = self.work_area.to_frame(detections, (x0, y0), width, height)
         if not stackx and not stacky:
-            for x, y in coordinates:
-                stackx.append(x)
-                stacky.append(y)
+            # Convert all targets to servo angles in one lookup
+            for angle_x, angle_y in self.targeting.to_angles(detections.centroid, (width, height)):
+                stackx.append(int(angle_x))
+                stacky.append(int(angle_y))
 
         # Pop from stacks and send to ESP8266
         if stackx and stacky:
             x = stackx.pop()
             y = stacky.pop()
-            message = f"{x},{y}\n"
+            message = angle_message(x, y)
             esp.write(message.encode())
-            print(f"Sent coordinates: {message.strip()}")
+            print(f"Sent angles: {message.strip()}")
 
         # Update stack length display
         self.progress_bar_counter.setValue(f"{len(stackx)}")
 
         # Convert annotated frame for processed display
-        rgb_annotated = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
+        rgb_annotated = bgr_to_rgb(self.pool, annotated_frame)
         height, width, channel = rgb_annotated.shape
         bytes_per_line = channel * width
         annotated_qimage = QImage(rgb_annotated.data, width, height, bytes_per_line, QImage.Format_RGB888)
-        self.image_container.setPixmap(QPixmap.fromImage(annotated_qimage))
-    
+        pixmap = QPixmap.fromImage(annotated_qimage)
+        if (x0, y0) != (0, 0):
+            # Only the small display image is enlarged, not the frame the model sees
+            pixmap = pixmap.scaled(self.image_container.size(), Qt.KeepAspectRatio, Qt.FastTransformation)
+        self.image_container.setPixmap(pixmap)
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.adjuster.restore()
+        self.source.close()
+        release_cameras()
+        self.inference.close()
+        print(self.pool.report())
+        print(self.scene.summary())
+        print(self.tracker.summary())
+        print(self.inference.summary())
+        event.accept()
 
         
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = USRControlSoftware()
+    # Opened here and not at import, the inference worker processes import this file too
+    esp = serial.Serial('COM11', 9600, timeout=1)  # Replace 'COM_PORT' with the actual ESP8266 port
+    # Worker processes with the model, each keeps its inference near 150 ms by adapting the input size
+    inference = InferencePool('june8.pt', target_ms=150)
+    # Optional camera index, video file or image folder to run on instead of camera 0
+    source = open_source(sys.argv[1], realtime=True) if len(sys.argv) > 1 else None
+    window = USRControlSoftware(inference, source)
     window.show()
     sys.exit(app.exec_())
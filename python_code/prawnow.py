@@ -1,34 +1,28 @@
+import sys
 import cv2
 import time
 import serial
-from ultralytics import YOLO
 
-from supporting.camera_output import capture_one_frame
+from supporting.frame_source import open_source
+from supporting.model_registry import get_model
+from supporting.detections import detect
 
 # Step 2: Initialize stacks and YOLO model
 stackx = []
 stacky = []
-model = YOLO('june8.pt') 
+model = get_model('june8.pt')
 esp = serial.Serial('COM10', 9600, timeout=1)  # Replace 'COM_PORT' with the actual ESP8266 port
+# Camera index, video file or image folder, replayed as fast as possible when recorded
+source = open_source(sys.argv[1] if len(sys.argv) > 1 else "0")
 
-def process_image_with_yolo(image):
-    results = model(frame)[0]
-    coordinates = []
-    for obj in results.boxes.data.tolist():
-        x1, y1, x2, y2, score, class_id = obj
-
-        x=int((x1+x2)//2)
-        y=int((y1+y2)//2)
-        x3, y3 = x,y  # Replace 'x' and 'y' with actual result keys
-        coordinates.append((x3, y3))
-    return coordinates
-
-while True:
+while not source.is_finished() or stackx:
     # Step 3: Check if stacks are empty
     if not stackx and not stacky:
-        frame = capture_one_frame()
-        coordinates = process_image_with_yolo(frame)
-        for x, y in coordinates:
+        latest = source.read(timeout=1.0)
+        if latest is None:
+            continue
+        _, _, frame = latest
+        for x, y in detect(model, frame).centroid.tolist():
             stackx.append(x)
             stacky.append(y)
 
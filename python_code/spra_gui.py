@@ -7,33 +7,27 @@ from PyQt5.QtWidgets import (
 )
 from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QImage, QPixmap
-from ultralytics import YOLO
 
-from supporting.camera_output import capture_one_frame
+from supporting.camera_output import get_camera, release_cameras
+from supporting.model_registry import get_model
+from supporting.image_adjust import ImageAdjuster, zoom_crop
+from supporting.detections import detect
 
 # Step 2: Initialize stacks and YOLO model
 stackx = []
 stacky = []
-model = YOLO('june8.pt')
+model = get_model('june8.pt')
 esp = serial.Serial('COM11', 9600, timeout=1)  # Replace 'COM_PORT' with the actual ESP8266 port
 
 
-def process_image_with_yolo(image):
-    results = model(image)[0]
-    coordinates = []
-    for obj in results.boxes.data.tolist():
-        x1, y1, x2, y2, score, class_id = obj
-        x = int((x1 + x2) // 2)
-        y = int((y1 + y2) // 2)
-        coordinates.append((x, y))
-    return coordinates
-
-
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("YOLO Object Tracker with GUI")
         self.setGeometry(100, 100, 800, 600)
+        self.camera = get_camera(0)
+        self.last_seq = 0
+        self.adjuster = ImageAdjuster(self.camera)
 
         # Main layout
         self.main_widget = QWidget(self)
@@ -93,38 +87,34 @@ class MainWindow(QMainWindow):
     def update_brightness_label(self):
         brightness_value = self.brightness_slider.value()
         self.brightness_slider_label.setText(f"Brightness: {brightness_value}")
+        self.adjuster.set_brightness(brightness_value)
 
     def update_saturation_label(self):
         saturation_value = self.saturation_slider.value()
         self.saturation_slider_label.setText(f"Saturation: {saturation_value}")
+        self.adjuster.set_saturation(saturation_value)
 
     def update_frame(self):
         global stackx, stacky
 
-        # Capture a frame
-        frame = capture_one_frame()
+        # Take the newest frame from the camera thread, skip the tick if nothing new arrived
+        latest = self.camera.latest()
+        if latest is None or latest[0] == self.last_seq:
+            return
+        self.last_seq, _, frame = latest
         if frame is None or frame.size == 0:
             print("Warning: Captured frame is empty.")
             return
 
         # Apply brightness and saturation adjustments
-        brightness = self.brightness_slider.value()
-        saturation = self.saturation_slider.value()
-        frame = cv2.convertScaleAbs(frame, alpha=saturation / 50, beta=brightness - 50)
-
-        # Zoom effect
-        zoom_factor = self.zoom_slider.value()
-        if zoom_factor > 1:
-            height, width, _ = frame.shape
-            center_x, center_y = width // 2, height // 2
-            radius_x, radius_y = width // (2 * zoom_factor), height // (2 * zoom_factor)
-            frame = frame[center_y - radius_y:center_y + radius_y, center_x - radius_x:center_x + radius_x]
-            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_LINEAR)
-
-        # YOLO Processing and stack update
+        frame = self.adjuster.apply(frame)
+
+        # Zoom effect: the centre crop goes straight to the model, which scales it to its input size
+        frame, (x0, y0) = zoom_crop(frame, self.zoom_slider.value())
+
+        # YOLO Processing and stack update, with positions mapped back to the full frame for the ESP8266
         if not stackx and not stacky:
-            coordinates = process_image_with_yolo(frame)
-            for x, y in coordinates:
+            for x, y in detect(model, frame).shift(x0, y0).centroid.tolist():
                 stackx.append(x)
                 stacky.append(y)
 
@@ -144,8 +134,17 @@ class MainWindow(QMainWindow):
         height, width, channel = rgb_image.shape
         bytes_per_line = channel * width
         qimage = QImage(rgb_image.data, width, height, bytes_per_line, QImage.Format_RGB888)
-        self.video_label.setPixmap(QPixmap.fromImage(qimage))
-
+        pixmap = QPixmap.fromImage(qimage)
+        if (x0, y0) != (0, 0):
+            # Only the small display image is enlarged, not the frame the model sees
+            pixmap = pixmap.scaled(self.video_label.size(), Qt.KeepAspectRatio, Qt.FastTransformation)
+        self.video_label.setPixmap(pixmap)
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.adjuster.restore()
+        release_cameras()
+        event.accept()
 
 
 if __name__ == "__main__":
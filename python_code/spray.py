@@ -1,20 +1,31 @@
+import os
 import sys
-import cv2
+import time
 import serial
 import psutil
 
-from ultralytics import YOLO
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QSlider,
     QComboBox, QPushButton, QCheckBox, QLineEdit, QGroupBox, QMessageBox
 )
 from PyQt5.QtGui import QPixmap, QColor, QIcon, QImage
 from PyQt5.QtCore import Qt, QTimer
-from supporting.camera_output import capture_one_frame
+from supporting.camera_output import get_camera, get_undistorter, release_cameras
+from supporting.model_registry import get_model
 from supporting.circular_progress_bar import CircularProgressBar
+from supporting.frame_quality import FrameQualityGate
+from supporting.buffer_pool import BufferPool, bgr_to_rgb, copy_into
+from supporting.targeting import TARGETING_FILE, TargetingModel, angle_message
+from supporting.work_area import WorkArea
+from supporting.detections import Detections, detect
+from supporting.adaptive_resolution import AdaptiveResolution
 import serial.tools.list_ports
 
 
+# Box colours per class id, BGR
+DETECTION_COLORS = {0: (0, 0, 255), 1: (0, 240, 0)}
+
+
 def get_available_ports():
     """
     Get a list of available serial ports.
@@ -26,13 +37,41 @@ def get_available_ports():
 class USRControlSoftware(QWidget):
     def __init__(self):
         super().__init__()
-        self.stackx = []  # Stack for x-coordinates
-        self.stacky = []  # Stack for y-coordinates
+        self.stackx = []  # Stack for servo x-angles
+        self.stacky = []  # Stack for servo y-angles
         self.esp = None
+        self.camera = get_camera(0)
+
+        # Pixel to servo angle lookup table, fitted with supporting/targeting.py
+        self.targeting = TargetingModel.load().build_lut()
+
+        # Detect on the raw frame and undistort only the target points. A fitted targeting
+        # table already absorbs the lens distortion, and the built-in fallback matrix is of
+        # another camera, so this is only done with a calibration of this camera and no table
+        self.undistorter = get_undistorter()
+        self.undistort_targets = self.undistorter.calibrated and not os.path.exists(TARGETING_FILE)
+
+        # Frames taken right after the robot moves are often blurred, wait this long for a usable one
+        self.quality_gate = FrameQualityGate()
+        self.quality_wait = 1.5
+        self.capture_poll_ms = 50
+        self.needs_frame = False
+        self.capturing = False
+        self.moved_seq = 0
+        self.checked_seq = 0
+        self.last_rejection = None
+
+        # Scratch buffers for the annotated and display images
+        self.pool = BufferPool()
+
+        # Part of the frame the turret can reach, set from the Set Area panel
+        self.work_area = WorkArea.load()
 
         # YOLO model initialization
         try:
-            self.model = YOLO('novlast.pt')
+            self.model = get_model('novlast.pt')
+            # Input size of the model follows the CPU load to keep each inference near 300 ms
+            self.adaptive = AdaptiveResolution(self.model, target_ms=300)
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to load YOLO model: {e}")
             sys.exit(1)
@@ -175,12 +214,12 @@ class USRControlSoftware(QWidget):
         set_area_layout = QHBoxLayout()
 
         height_label = QLabel("Height")
-        self.height_input = QLineEdit("0")
+        self.height_input = QLineEdit(str(self.work_area.height))
         self.height_input.setFixedSize(60, 20)
         height_button = QPushButton("OK")
 
         width_label = QLabel("Width")
-        self.width_input = QLineEdit("0")
+        self.width_input = QLineEdit(str(self.work_area.width))
         self.width_input.setFixedSize(60, 20)
         width_button = QPushButton("Close")
 
@@ -197,6 +236,8 @@ class USRControlSoftware(QWidget):
         set_area_layout.addLayout(height_layout)
         set_area_layout.addLayout(width_layout)
         set_area_group.setLayout(set_area_layout)
+        height_button.clicked.connect(self.apply_work_area)
+        width_button.clicked.connect(self.clear_work_area)
 
         self.left_panel.addWidget(set_area_group)
 
@@ -262,6 +303,24 @@ class USRControlSoftware(QWidget):
     def update_saturation_label(self):
         saturation_value = self.saturation_slider.value()
         self.saturation_slider_label.setText(f"Saturation: {saturation_value}")
+
+    def apply_work_area(self):
+        # Height and width in pixels of a 640x480 frame, 0 keeps the full frame in that direction
+        try:
+            height, width = int(self.height_input.text()), int(self.width_input.text())
+        except ValueError:
+            self.status_box.setText("Set Area: height and width must be whole numbers of pixels")
+            return
+        self.work_area = WorkArea(max(width, 0), max(height, 0), self.work_area.polygon)
+        self.work_area.save()
+        self.status_box.setText(f"Work area set to {self.work_area.width}x{self.work_area.height}")
+
+    def clear_work_area(self):
+        self.height_input.setText("0")
+        self.width_input.setText("0")
+        self.work_area = WorkArea()
+        self.work_area.save()
+        self.status_box.setText("Work area cleared, detecting on the full frame")
     
     def process_and_send_coordinates(self):
         """
@@ -272,65 +331,106 @@ class USRControlSoftware(QWidget):
             self.status_box.setText(f"ESP is not connected.")
             return
 
+        # A move whose frame did not pass the quality gate yet, retry the capture without moving again
+        if self.needs_frame:
+            if not self.capturing:
+                self.start_capture()
+            return
+
         # Step 3: Check if stacks are empty
         if not self.stackx and not self.stacky:
             
             message = f"runesp2\n"
+            latest = self.camera.latest()
             self.esp.write(message.encode())
 
-            frame = capture_one_frame()
-            if frame is None or frame.size == 0:
-                print("Warning: Captured frame is empty.")
-                self.status_box.setText(f"Warning: Captured frame is empty.")
-                return
-
-            coordinates,annotated_frame = self.process_image_with_yolo(frame)
-
-            # Convert frame to RGB for displaying
-            rgb_image = cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB)
-            height, width, channel = rgb_image.shape
-            bytes_per_line = channel * width
-            qimage = QImage(rgb_image.data, width, height, bytes_per_line, QImage.Format_RGB888)
-            self.image_container.setPixmap(QPixmap.fromImage(qimage))
-
-            for x, y in coordinates:
-                self.stackx.append(x)
-                self.stacky.append(y)
-            self.progress_bar_counter.setValue(len(self.stackx))
+            # Only frames grabbed after the command was sent show the new position
+            self.moved_seq = latest[0] if latest else 0
+            self.needs_frame = True
+            self.start_capture()
         else:
             # Step 5: Pop from stacks and send to ESP8266
             self.progress_bar_remaining.setValue(len(self.stackx))
             x = self.stackx.pop()
             y = self.stacky.pop()
-            message = f"{x},{y}\n"
+            message = angle_message(x, y)
             self.esp.write(message.encode())
-            print(f"Sent coordinates: {message.strip()}")
-            self.status_box.setText(f"Sent coordinates: {message.strip()}")
+            print(f"Sent angles: {message.strip()}")
+            self.status_box.setText(f"Sent angles: {message.strip()}")
+
+    def start_capture(self):
+        # Look for a usable frame for up to quality_wait seconds, polling from the Qt event loop
+        self.capturing = True
+        self.last_rejection = None
+        self.capture_deadline = time.monotonic() + self.quality_wait
+        self.poll_capture()
+
+    def poll_capture(self):
+        """
+        Check the newest frame since the move against the quality gate and detect on the first
+        usable one. Blurred or badly exposed frames are skipped instead of spending inference
+        time on them. Without one before the deadline the move stays pending for the next tick.
+        """
+        latest = self.camera.latest()
+        if latest is not None and latest[0] > self.checked_seq and latest[0] > self.moved_seq and latest[2].size:
+            self.checked_seq = latest[0]
+            ok, reason, _ = self.quality_gate.check(latest[2])
+            if ok:
+                self.capturing = False
+                self.needs_frame = False
+                self.process_frame(latest[2])
+                return
+            self.last_rejection = reason
+
+        if time.monotonic() < self.capture_deadline:
+            QTimer.singleShot(self.capture_poll_ms, self.poll_capture)
+            return
+
+        self.capturing = False
+        reason = self.last_rejection or "no new frame"
+        print(f"Warning: No usable frame ({reason}), retrying on the next tick. {self.quality_gate.summary()}")
+        self.status_box.setText(f"Warning: No usable frame ({reason}), retrying.\n{self.quality_gate.summary()}")
+
+    def process_frame(self, frame):
+        targets, annotated_frame = self.process_image_with_yolo(frame)
+
+        # Convert frame to RGB for displaying
+        rgb_image = bgr_to_rgb(self.pool, annotated_frame)
+        height, width, channel = rgb_image.shape
+        bytes_per_line = channel * width
+        qimage = QImage(rgb_image.data, width, height, bytes_per_line, QImage.Format_RGB888)
+        self.image_container.setPixmap(QPixmap.fromImage(qimage))
+
+        # Convert all targets to servo angles in one lookup
+        height, width = frame.shape[:2]
+        for angle_x, angle_y in self.targeting.to_angles(targets, (width, height)):
+            self.stackx.append(int(angle_x))
+            self.stacky.append(int(angle_y))
+        self.progress_bar_counter.setValue(len(self.stackx))
 
     def process_image_with_yolo(self, image):
         """
-        Process the image using YOLO and return coordinates and annotated image.
+        Process the image using YOLO and return the target points and annotated image.
         """
-        results = self.model(image)[0]
-        coordinates = []
-        annotated_frame = image.copy()
-
-
-        for obj in results.boxes.data.tolist():
-            x1, y1, x2, y2, score, class_id = obj
-            x = int((x1 + x2) // 2)
-            y = int((y1 + y2) // 2)
-            coordinates.append((x, y))
-
-            # Draw bounding box and label
-            detection_color= (0, 0, 255) if int(class_id)==0 else (0, 240, 0)
-            label = f"{self.model.names[int(class_id)]}: {score:.2f}"
-            cv2.rectangle(annotated_frame, (int(x1), int(y1)), (int(x2), int(y2)), detection_color, 2)
-            cv2.putText(
-                annotated_frame, label, (int(x1), int(y1) - 10),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.5, detection_color, 2
-            )
-        return coordinates, annotated_frame
+        # Only the area the turret can reach goes to the model, boxes are shifted back to the frame
+        area, offset = self.work_area.crop(image, self.pool)
+        height, width = image.shape[:2]
+        if area.size:
+            detections = self.work_area.to_frame(detect(self.adaptive, area), offset, width, height)
+        else:
+            # The Set Area rectangle and polygon do not overlap, there is nothing to detect on
+            detections = Detections.empty()
+
+        annotated_frame = copy_into(self.pool, "annotated", image)
+        self.work_area.draw(annotated_frame)
+        detections.draw(annotated_frame, DETECTION_COLORS)
+
+        # Correct all centroids in one call instead of warping the whole frame. Uncropped, so the
+        # points keep the centre and pixel scale of the width x height frame the targeting table is given
+        if self.undistort_targets and len(detections):
+            _, centroids = self.undistorter.undistort_boxes(detections.xyxy, width, height, crop=False)
+            return centroids, annotated_frame
+        return detections.centroid, annotated_frame
 
     def update_frame(self):
         if self.esp is None or not self.esp.is_open:
@@ -338,7 +438,8 @@ class USRControlSoftware(QWidget):
             self.status_box.setText(f"Warning: ESP is not connected..")
             return
 
-        frame = capture_one_frame()
+        latest = self.camera.latest()
+        frame = latest[2] if latest else None
         if frame is None or frame.size == 0:
             print("Warning: Captured frame is empty.")
             self.status_box.setText(f"Warning: Captured frame is empty.")
@@ -350,6 +451,9 @@ class USRControlSoftware(QWidget):
 
 
     def closeEvent(self, event):
+        release_cameras()
+        print(self.pool.report())
+        print(self.adaptive.summary())
         if self.esp and self.esp.is_open:
             self.esp.close()
         event.accept()
@@ -1,13 +1,12 @@
 import sys
-import cv2
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QLabel, QPushButton, QVBoxLayout, QWidget, QHBoxLayout, QStatusBar
 )
 from PyQt5.QtGui import QPixmap, QImage, QFont
 from PyQt5.QtCore import Qt, QTimer
-from ultralytics import YOLO
-
-from supporting.camera_output import capture_one_frame
+from supporting.camera_output import get_camera, release_cameras
+from supporting.model_registry import get_model
+from supporting.detections import detect
 
 class YOLOv8LiveGUI(QMainWindow):
     def __init__(self):
@@ -67,12 +66,15 @@ class YOLOv8LiveGUI(QMainWindow):
         # Initialize variables for webcam and timer
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_frame)
-        self.cap = None
+        self.camera = None
+
+        # Loaded and warmed up once here instead of on every timer tick
+        self.model = get_model('june8.pt')
 
     def start_webcam(self):
         # Open webcam
-        self.cap = cv2.VideoCapture(0)
-        if not self.cap.isOpened():
+        self.camera = get_camera(0)
+        if not self.camera.is_opened():
             self.statusBar.showMessage("Error: Could not open webcam", 5000)
             return
 
@@ -84,45 +86,39 @@ class YOLOv8LiveGUI(QMainWindow):
     def stop_webcam(self):
         # Stop the timer and release the webcam
         self.timer.stop()
-        if self.cap:
-            self.cap.release()
+        if self.camera:
+            release_cameras()
+            self.camera = None
         self.video_label.setText("Webcam stopped")
         self.start_button.setEnabled(True)
         self.stop_button.setEnabled(False)
         self.statusBar.showMessage("Webcam stopped", 3000)
 
     def update_frame(self):
-        
-        model = YOLO('june8.pt') 
 
         threshold = 0
         stackx = []
         stacky = []
 
-        # Load an image
-        frame = capture_one_frame()
+        # Take the newest frame from the camera thread, copied because it is drawn on below
+        latest = self.camera.latest()
+        if latest is None:
+            return
+        frame = latest[2].copy()
 
         # Predict the image
-        results = model(frame)[0]
+        detections = detect(self.model, frame, threshold)
         print("Is the stacks empty?", len(stackx) == 0 and len(stacky) == 0 )  # Output: True
 
-        for result in results.boxes.data.tolist():
-            x1, y1, x2, y2, score, class_id = result
-            detection_color= (0, 255, 0) if int(class_id)==0 else (0, 0, 255)
-            if score > threshold:
-                cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), detection_color, 4)
-                cv2.putText(frame, results.names[int(class_id)].upper(), (int(x1), int(y1 - 10)),
-                            cv2.FONT_HERSHEY_SIMPLEX, 1.3, detection_color, 3, cv2.LINE_AA)
-                print('cordinates',x1,y1,x2,y2)
-
-                #calculating the scaling constant
-                x=int((x1+x2)//2)
-                y=int((y1+y2)//2)
-                # Push elements to the stack
-                stackx.append(x)
-                stacky.append(y)
-
-        annotated_frame = results[0].plot()
+        detections.draw(frame, {0: (0, 255, 0), 1: (0, 0, 255)}, thickness=4, font_scale=1.3, label_score=False)
+        for x1, y1, x2, y2 in detections.xyxy.tolist():
+            print('cordinates',x1,y1,x2,y2)
+
+        # Push all centroids to the stacks
+        stackx.extend(detections.centroid[:, 0].tolist())
+        stacky.extend(detections.centroid[:, 1].tolist())
+
+        annotated_frame = frame
 
         # Convert the annotated frame to QImage for display in QLabel
         height, width, channel = annotated_frame.shape
@@ -0,0 +1,93 @@
+#Steps the model input size down when inference gets slow and back up when there is time to spare
+import time
+
+# Input sizes to choose from, multiples of the 32 pixel YOLO stride
+DEFAULT_LADDER = (320, 416, 512, 640)
+
+
+class AdaptiveResolution:
+    """
+    Wraps a model and passes imgsz from `ladder` with every call, timing each call.
+    When the smoothed latency stays above `target_ms` plus the `band` for `patience` calls
+    the size steps down; it steps back up only when the latency expected at the next size
+    (scaling with the pixel count) is below `target_ms` minus the band. After a change
+    the size is held for `cooldown` calls so one slow frame does not bounce it around.
+    The exported ONNX and OpenVINO graphs have a fixed input size, so with those
+    backends the size stays at the export size.
+    """
+
+    def __init__(self, model, target_ms=150, ladder=DEFAULT_LADDER, band=0.15, patience=3,
+                 cooldown=10, smoothing=0.3):
+        self.model = model
+        self.target_ms = target_ms
+        self.ladder = sorted(ladder)
+        self.band = band
+        self.patience = patience
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.fixed = getattr(model, 'backend', 'torch') != 'torch'
+
+        self.level = len(self.ladder) - 1
+        self.latency_ms = None
+        self.over = 0
+        self.under = 0
+        self.hold = 0
+        self.decisions = []
+
+    @property
+    def imgsz(self):
+        return self.ladder[self.level]
+
+    def __call__(self, image, **kwargs):
+        if self.fixed:
+            return self.model(image, **kwargs)
+        kwargs.setdefault('imgsz', self.imgsz)
+        start = time.perf_counter()
+        results = self.model(image, **kwargs)
+        self.record((time.perf_counter() - start) * 1000)
+        return results
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def record(self, latency_ms):
+        if self.latency_ms is None:
+            self.latency_ms = latency_ms
+        else:
+            self.latency_ms += self.smoothing * (latency_ms - self.latency_ms)
+
+        if self.hold > 0:
+            self.hold -= 1
+            return
+
+        high = self.target_ms * (1 + self.band)
+        low = self.target_ms * (1 - self.band)
+        self.over = self.over + 1 if self.latency_ms > high else 0
+        if self.level + 1 < len(self.ladder):
+            expected = self.latency_ms * (self.ladder[self.level + 1] / self.imgsz) ** 2
+            self.under = self.under + 1 if expected < low else 0
+        else:
+            self.under = 0
+
+        if self.over >= self.patience and self.level > 0:
+            self.change(self.level - 1)
+        elif self.under >= self.patience:
+            self.change(self.level + 1)
+
+    def change(self, level):
+        old = self.imgsz
+        self.level = level
+        self.over = self.under = 0
+        self.hold = self.cooldown
+        decision = (time.strftime("%H:%M:%S"), old, self.imgsz, round(self.latency_ms, 1))
+        self.decisions.append(decision)
+        print(f"Adaptive resolution: imgsz {old} -> {self.imgsz}, "
+              f"latency {self.latency_ms:.0f} ms for a {self.target_ms} ms target")
+        # The old average belongs to the old size, start over from the next measurement
+        self.latency_ms = None
+
+    def summary(self):
+        if self.fixed:
+            return f"Adaptive resolution: off, the {self.model.backend} backend has a fixed input size"
+        latency = f"{self.latency_ms:.0f} ms" if self.latency_ms is not None else "not measured"
+        return f"Adaptive resolution: imgsz {self.imgsz}, latency {latency}, {len(self.decisions)} changes"
@@ -0,0 +1,165 @@
+#On-disk cache of exported models, keyed by the weights content and the export settings
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+from importlib import metadata
+
+CACHE_DIR = os.environ.get('USR_MODEL_CACHE', 'model_cache')
+# Least recently used entries are removed once the cache grows past this size
+CACHE_LIMIT_BYTES = 2 * 1024 ** 3
+
+# Library versions that change what an export produces or whether it still loads
+VERSIONED_PACKAGES = ('ultralytics', 'torch', 'onnx', 'onnxruntime', 'openvino')
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def package_versions():
+    versions = {}
+    for package in VERSIONED_PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def ultralytics_export(weights, workdir, backend, imgsz, precision):
+    # Ultralytics writes the export next to the weights, which here is the copy inside workdir
+    from ultralytics import YOLO
+    exported = YOLO(weights).export(format=backend, imgsz=imgsz, half=precision == 'fp16')
+    # Only newer Ultralytics versions return the path, 8.0.x returns None
+    if exported is not None:
+        return str(exported)
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    artifact = os.path.join(workdir, stem + '.onnx' if backend == 'onnx' else stem + f'_{backend}_model')
+    if not os.path.exists(artifact):
+        raise FileNotFoundError(f"Ultralytics export to {backend} did not write {artifact}")
+    return artifact
+
+
+def dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+
+
+class ArtifactCache:
+    """
+    Exported model artifacts stored under `root`, one folder per key. The key covers the
+    SHA-256 of the weights, backend, input size, precision and library versions, so changed
+    weights or an upgraded runtime always miss instead of loading a stale export.
+    Entries are built in a temporary folder and renamed into place, so a crash during an
+    export never leaves a half-written entry behind.
+    """
+
+    def __init__(self, root=CACHE_DIR, limit_bytes=CACHE_LIMIT_BYTES):
+        self.root = root
+        self.limit_bytes = limit_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, weights, backend, imgsz, precision, extra=None):
+        fields = {
+            'weights_sha256': file_sha256(weights),
+            'backend': backend,
+            'imgsz': imgsz,
+            'precision': precision,
+            'versions': package_versions(),
+        }
+        if extra:
+            fields['extra'] = extra
+        digest = hashlib.sha256(json.dumps(fields, sort_keys=True).encode()).hexdigest()[:20]
+        return digest, fields
+
+    def get(self, weights, backend, imgsz=640, precision='fp32', exporter=ultralytics_export, extra=None):
+        """
+        Return the path of the artifact for these settings, exporting it on a miss.
+        `exporter(weights, workdir, backend, imgsz, precision)` must write into workdir
+        and return the artifact path. `extra` is a JSON-serialisable dict of anything else
+        the export depends on, like the calibration images of a quantized model.
+        """
+        digest, fields = self.key(weights, backend, imgsz, precision, extra)
+        stem = os.path.splitext(os.path.basename(weights))[0]
+        entry = os.path.join(self.root, f"{stem}-{backend}-{digest}")
+        meta_path = os.path.join(entry, 'meta.json')
+
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+            # Touch the entry for the least recently used eviction
+            os.utime(meta_path)
+            self.hits += 1
+            return os.path.join(entry, meta['artifact'])
+
+        self.misses += 1
+        os.makedirs(self.root, exist_ok=True)
+        workdir = tempfile.mkdtemp(prefix=f".{stem}-", dir=self.root)
+        try:
+            local_weights = os.path.join(workdir, os.path.basename(weights))
+            shutil.copy2(weights, local_weights)
+            start = time.monotonic()
+            artifact = exporter(local_weights, workdir, backend, imgsz, precision)
+            os.remove(local_weights)
+
+            meta = dict(fields, artifact=os.path.relpath(artifact, workdir), source=os.path.abspath(weights),
+                        export_seconds=round(time.monotonic() - start, 1),
+                        created=time.strftime("%Y-%m-%dT%H:%M:%S"))
+            with open(os.path.join(workdir, 'meta.json'), 'w') as f:
+                json.dump(meta, f, indent=2)
+
+            try:
+                os.rename(workdir, entry)
+            except OSError:
+                # Another process finished the same export first, use theirs
+                shutil.rmtree(workdir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+
+        self.evict(keep=entry)
+        return os.path.join(entry, meta['artifact'])
+
+    def entries(self):
+        # (last_used, size, path) of every complete entry
+        entries = []
+        if not os.path.isdir(self.root):
+            return entries
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            meta_path = os.path.join(path, 'meta.json')
+            if name.startswith('.') or not os.path.exists(meta_path):
+                continue
+            entries.append((os.path.getmtime(meta_path), dir_size(path), path))
+        return entries
+
+    def evict(self, keep=None):
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.limit_bytes:
+                break
+            if path == keep:
+                continue
+            print(f"Evicting {path} from the model cache")
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+_cache = None
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = ArtifactCache()
+    return _cache
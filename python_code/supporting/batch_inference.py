@@ -0,0 +1,166 @@
+#Collects frames from several cameras or queued captures and runs them through the model as one batch
+import time
+import queue
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+from supporting.detections import Detections
+
+# Upper bounds in milliseconds of the wait time histogram, the last bucket takes the rest
+WAIT_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100)
+
+
+class BatchResult:
+    # Detections of one submitted frame, routed back with the source and frame timestamp it came with
+    __slots__ = ('source', 'timestamp', 'detections', 'batch_size', 'wait_ms')
+
+    def __init__(self, source, timestamp, detections, batch_size, wait_ms):
+        self.source = source
+        self.timestamp = timestamp
+        self.detections = detections
+        self.batch_size = batch_size
+        self.wait_ms = wait_ms
+
+
+class MicroBatcher:
+    """
+    Queues frames from any number of sources and runs them through `model` together. A batch
+    is started as soon as `max_batch` frames are waiting, or `max_wait_ms` after its first
+    frame arrived, whichever comes first. submit() returns a Future of a BatchResult and
+    optionally calls `callback(result)` from the batching thread.
+    Batch sizes and the time frames spent waiting for their batch are kept as histograms,
+    a larger batch or deadline raises throughput at the cost of latency.
+    """
+
+    def __init__(self, model, max_batch=4, max_wait_ms=20, **model_kwargs):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.model_kwargs = model_kwargs
+        self.queue = queue.Queue()
+        self.batch_sizes = Counter()
+        self.wait_counts = Counter()
+        self.inference_ms = 0.0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, source=None, timestamp=None, callback=None):
+        future = Future()
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        self.queue.put((frame, source, timestamp, callback, future, time.perf_counter()))
+        return future
+
+    def collect(self):
+        # Block for the first frame, then take more until the batch is full or its deadline passes
+        try:
+            first = self.queue.get(timeout=0.1)
+        except queue.Empty:
+            return []
+        if first is None:
+            return None
+        batch = [first]
+        deadline = first[5] + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self.running = False
+                break
+            batch.append(item)
+        return batch
+
+    def run(self):
+        while self.running:
+            batch = self.collect()
+            if batch is None:
+                break
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = self.model([item[0] for item in batch], verbose=False, **self.model_kwargs)
+            except Exception as e:
+                for item in batch:
+                    item[4].set_exception(e)
+                continue
+            self.inference_ms += (time.perf_counter() - started) * 1000
+            self.batch_sizes[len(batch)] += 1
+
+            for (frame, source, timestamp, callback, future, queued), result in zip(batch, results):
+                wait_ms = (started - queued) * 1000
+                self.wait_counts[next((b for b in WAIT_BUCKETS_MS if wait_ms <= b), None)] += 1
+                routed = BatchResult(source, timestamp, Detections.from_result(result), len(batch), wait_ms)
+                future.set_result(routed)
+                if callback is not None:
+                    callback(routed)
+
+        # Frames still queued after close() are not run
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[4].cancel()
+
+    def close(self):
+        self.running = False
+        self.queue.put(None)
+        self.thread.join(timeout=5)
+
+    def report(self):
+        batches = sum(self.batch_sizes.values())
+        if batches == 0:
+            return "Micro-batching: no batches yet"
+        frames = sum(size * count for size, count in self.batch_sizes.items())
+        sizes = ", ".join(f"{size}: {self.batch_sizes[size]}" for size in sorted(self.batch_sizes))
+        waits = ", ".join(
+            f"<={bucket} ms: {self.wait_counts[bucket]}" for bucket in WAIT_BUCKETS_MS if self.wait_counts[bucket]
+        )
+        if self.wait_counts[None]:
+            waits += f", >{WAIT_BUCKETS_MS[-1]} ms: {self.wait_counts[None]}"
+        return (f"Micro-batching: {frames} frames in {batches} batches (mean {frames / batches:.1f}), "
+                f"{self.inference_ms / frames:.1f} ms per frame\n"
+                f"  batch sizes {{{sizes}}}\n"
+                f"  wait times {{{waits}}}")
+
+
+if __name__ == "__main__":
+    from supporting.model_registry import get_model
+    from supporting.multi_camera import MultiCameraCapture
+
+    parser = argparse.ArgumentParser(description="Batched detection on several cameras")
+    parser.add_argument("--cameras", type=int, nargs='+', default=[0, 1], help="Camera indices")
+    parser.add_argument("--weights", default='novlast.pt', help="Model weights")
+    parser.add_argument("--batch", type=int, default=4, help="Largest batch")
+    parser.add_argument("--wait", type=float, default=20, help="Longest wait for a batch to fill, in ms")
+    parser.add_argument("--seconds", type=float, default=20, help="How long to run")
+    args = parser.parse_args()
+
+    batcher = MicroBatcher(get_model(args.weights), args.batch, args.wait)
+    capture = MultiCameraCapture(args.cameras).start()
+    end = time.monotonic() + args.seconds
+    try:
+        while time.monotonic() < end:
+            frame_set = capture.read_set(timeout=1.0)
+            if frame_set is None:
+                continue
+            # Every camera's frame goes in on its own, the batcher groups them
+            futures = [batcher.submit(frame, index, timestamp)
+                       for index, (_, timestamp, frame) in zip(args.cameras, frame_set.frames)]
+            for future in futures:
+                result = future.result()
+                print(f"camera {result.source} frame {result.timestamp:.3f}: {len(result.detections)} detections "
+                      f"(batch of {result.batch_size}, waited {result.wait_ms:.1f} ms)")
+    finally:
+        capture.stop()
+        batcher.close()
+        print(capture.report())
+        print(batcher.report())
@@ -0,0 +1,75 @@
+#Reusable frame buffers so the detect and draw path stops allocating a new image every frame
+import sys
+import cv2
+import numpy as np
+
+
+def peak_rss_mb():
+    # Peak resident memory of this process in MB
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+        return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+    except ImportError:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024.0 * 1024.0)
+
+
+class BufferPool:
+    """
+    Named scratch buffers keyed by (name, shape, dtype). get() hands back the same array
+    every time it is asked for the same key, so a buffer's content is only valid until the
+    next call that uses the same name. Not thread safe, give every thread its own pool.
+    """
+
+    def __init__(self):
+        self.buffers = {}
+        self.allocations = 0
+        self.allocated_bytes = 0
+        self.reuses = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        key = (name, tuple(shape), np.dtype(dtype))
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+            self.buffers[key] = buffer
+            self.allocations += 1
+            self.allocated_bytes += buffer.nbytes
+        else:
+            self.reuses += 1
+        return buffer
+
+    def like(self, name, image):
+        return self.get(name, image.shape, image.dtype)
+
+    def stats(self):
+        return {
+            'buffers': len(self.buffers),
+            'allocations': self.allocations,
+            'allocated_mb': self.allocated_bytes / (1024.0 * 1024.0),
+            'reuses': self.reuses,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+    def report(self):
+        stats = self.stats()
+        return (f"Buffer pool: {stats['allocations']} allocations ({stats['allocated_mb']:.1f} MB), "
+                f"{stats['reuses']} reuses, peak RSS {stats['peak_rss_mb']:.1f} MB")
+
+
+# Pipeline helpers, each writes its result into a pooled buffer through OpenCV's dst argument
+
+def copy_into(pool, name, image):
+    out = pool.like(name, image)
+    np.copyto(out, image)
+    return out
+
+
+def bgr_to_rgb(pool, image, name="rgb"):
+    out = pool.like(name, image)
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=out)
+    return out
+
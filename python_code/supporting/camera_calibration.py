@@ -1,59 +1,178 @@
+import os
 import cv2
-import numpy as np
+import json
 import glob
+import time
+import argparse
+import numpy as np
+from multiprocessing import Pool
+
+# Bumped whenever the layout of the saved calibration file changes
+CALIBRATION_VERSION = 1
+
+# Criteria for corner detection
+criteria = (cv2.TermCriteria_EPS + cv2.TermCriteria_MAX_ITER, 30, 0.001)
+
+
+def find_corners(job):
+    """
+    Find the chessboard corners of one image. The board is searched on a downscaled copy
+    and the corners are then refined with cornerSubPix at full resolution.
+    Returns (image_file, image_size, corners), corners is None if the board was not found.
+    """
+    image_file, chessboard_size, detect_width = job
+    img = cv2.imread(image_file, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return image_file, None, None
+    h, w = img.shape[:2]
 
-def camera_calibration(chessboard_size, frame_size, chessboard_images_path):
-    # Criteria for corner detection
-    criteria = (cv2.TermCriteria_EPS + cv2.TermCriteria_MAX_ITER, 30, 0.001)
-    
+    scale = min(1.0, detect_width / w)
+    small = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA) if scale < 1.0 else img
+    ret, corners = cv2.findChessboardCorners(
+        small, chessboard_size, cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE
+    )
+    if not ret:
+        return image_file, (w, h), None
+
+    # Back to full resolution, with the search window grown to cover the downscale error
+    corners = corners / scale
+    window = max(11, int(round(2 / scale)))
+    corners = cv2.cornerSubPix(img, corners.astype(np.float32), (window, window), (-1, -1), criteria)
+    return image_file, (w, h), corners
+
+
+def reprojection_errors(objpoints, imgpoints, rvecs, tvecs, camera_matrix, dist_coeffs):
+    # RMS distance in pixels between detected and reprojected corners, per view
+    errors = []
+    for objp, imgp, rvec, tvec in zip(objpoints, imgpoints, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(objp, rvec, tvec, camera_matrix, dist_coeffs)
+        diff = imgp.reshape(-1, 2) - projected.reshape(-1, 2)
+        errors.append(float(np.sqrt(np.mean(np.sum(diff ** 2, axis=1)))))
+    return errors
+
+
+def camera_calibration(chessboard_size, frame_size, chessboard_images_path, workers=None,
+                       detect_width=1200, max_view_error=3.0, show=False):
+    """
+    Calibrate from the chessboard images in a folder. Corner detection runs in a process pool,
+    views whose reprojection error is above `max_view_error` pixels are dropped and the
+    calibration is run again without them.
+    Returns a dict with camera_matrix, dist_coeffs, rms, views and per-view errors, or None.
+    """
     # Prepare object points like (0,0,0), (1,0,0), (2,0,0), ..., (chessboard_size[0]-1, chessboard_size[1]-1, 0)
     objp = np.zeros((chessboard_size[0]*chessboard_size[1], 3), np.float32)
     objp[:, :2] = np.mgrid[0:chessboard_size[0], 0:chessboard_size[1]].T.reshape(-1, 2)
-    
-    # Arrays to store object points and image points from all the images
-    objpoints = []  # 3d points in real world space
-    imgpoints = []  # 2d points in image plane
 
-    # Read all images from the provided path
-    images = glob.glob(chessboard_images_path + '/*.jpg')
+    # Read all images from the provided path, the action camera writes upper case extensions
+    images = sorted(set(glob.glob(os.path.join(chessboard_images_path, '*.jpg')) +
+                        glob.glob(os.path.join(chessboard_images_path, '*.JPG'))))
     print(f"Found {len(images)} images.")
+    if not images:
+        return None
 
-    for image_file in images:
-        img = cv2.imread(image_file)
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        
-        # Find the chessboard corners
-        ret, corners = cv2.findChessboardCorners(gray, chessboard_size, None)
-
-        # If found, add object points, image points (after refining them)
-        if ret == True:
-            objpoints.append(objp)
-            corners2 = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), criteria)
-            imgpoints.append(corners2)
+    start = time.monotonic()
+    jobs = [(image_file, chessboard_size, detect_width) for image_file in images]
+    with Pool(workers) as pool:
+        detections = pool.map(find_corners, jobs)
+    print(f"Corner detection took {time.monotonic() - start:.1f} s")
 
+    # Arrays to store object points and image points from all the images
+    views = []
+    objpoints = []  # 3d points in real world space
+    imgpoints = []  # 2d points in image plane
+    for image_file, image_size, corners in detections:
+        if corners is None:
+            print(f"Failed to detect chessboard corners in {image_file}")
+            continue
+        if image_size != tuple(frame_size):
+            print(f"Skipping {image_file}: size {image_size} does not match {tuple(frame_size)}")
+            continue
+        views.append(image_file)
+        objpoints.append(objp)
+        imgpoints.append(corners)
+
+        if show:
             # Draw and display the corners
-            cv2.drawChessboardCorners(img, chessboard_size, corners2, ret)
+            img = cv2.imread(image_file)
+            cv2.drawChessboardCorners(img, chessboard_size, corners, True)
             cv2.imshow('Chessboard', img)
             cv2.waitKey(500)
-        else:
-            print(f"Failed to detect chessboard corners in {image_file}")
+    if show:
+        cv2.destroyAllWindows()
 
-    cv2.destroyAllWindows()
+    if not objpoints:
+        print("Calibration failed: no chessboard corners were detected in any image.")
+        return None
 
     # Perform camera calibration
-    if len(objpoints) > 0 and len(imgpoints) > 0:
-        ret, camera_matrix, dist_coeffs, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, frame_size, None, None)
-        print("Camera Matrix:\n", camera_matrix)
-        print("Distortion Coefficients:\n", dist_coeffs)
-        return camera_matrix, dist_coeffs
+    rms, camera_matrix, dist_coeffs, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, frame_size, None, None)
+    errors = reprojection_errors(objpoints, imgpoints, rvecs, tvecs, camera_matrix, dist_coeffs)
+
+    # Drop outlier views and calibrate again, as long as enough views are left
+    keep = [i for i, error in enumerate(errors) if error <= max_view_error]
+    rejected = [(views[i], errors[i]) for i in range(len(views)) if errors[i] > max_view_error]
+    if rejected and len(keep) >= 3:
+        for image_file, error in rejected:
+            print(f"Rejecting {image_file}: reprojection error {error:.3f} px")
+        views = [views[i] for i in keep]
+        objpoints = [objpoints[i] for i in keep]
+        imgpoints = [imgpoints[i] for i in keep]
+        rms, camera_matrix, dist_coeffs, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, frame_size, None, None)
+        errors = reprojection_errors(objpoints, imgpoints, rvecs, tvecs, camera_matrix, dist_coeffs)
     else:
-        print("Calibration failed: no chessboard corners were detected in any image.")
-        return None, None
+        rejected = []
+
+    print("Camera Matrix:\n", camera_matrix)
+    print("Distortion Coefficients:\n", dist_coeffs)
+    print(f"RMS reprojection error: {rms:.3f} px over {len(views)} views")
+    return {
+        'camera_matrix': camera_matrix,
+        'dist_coeffs': dist_coeffs,
+        'frame_size': tuple(frame_size),
+        'rms': float(rms),
+        'views': [os.path.basename(view) for view in views],
+        'view_errors': errors,
+        'rejected': [os.path.basename(view) for view, _ in rejected],
+    }
+
+
+def save_calibration(output_path, calibration):
+    """
+    Write the calibration to `output_path` (.npz, loaded by camera_output.Undistorter)
+    and a .json next to it with the same content for reading and diffing.
+    """
+    stem = os.path.splitext(output_path)[0]
+    created = time.strftime("%Y-%m-%dT%H:%M:%S")
+    np.savez(
+        stem + '.npz',
+        version=CALIBRATION_VERSION,
+        created=created,
+        camera_matrix=calibration['camera_matrix'],
+        dist_coeffs=calibration['dist_coeffs'],
+        frame_size=np.array(calibration['frame_size']),
+        rms=calibration['rms'],
+        view_errors=np.array(calibration['view_errors']),
+    )
+
+    summary = {
+        'version': CALIBRATION_VERSION,
+        'created': created,
+        'frame_size': list(calibration['frame_size']),
+        'camera_matrix': np.asarray(calibration['camera_matrix']).tolist(),
+        'dist_coeffs': np.asarray(calibration['dist_coeffs']).ravel().tolist(),
+        'rms': calibration['rms'],
+        'views': dict(zip(calibration['views'], calibration['view_errors'])),
+        'rejected': calibration['rejected'],
+    }
+    with open(stem + '.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(f"Calibration saved to {stem}.npz and {stem}.json")
+
 
 def undistort_image(image_path, camera_matrix, dist_coeffs):
     img = cv2.imread(image_path)
     h, w = img.shape[:2]
-    
+
     # Refine the camera matrix
     new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, (w, h), 1, (w, h))
 
@@ -67,25 +186,33 @@ def undistort_image(image_path, camera_matrix, dist_coeffs):
     return undistorted_img
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the camera from chessboard photos")
     # Chessboard configuration
-    chessboard_size = (8, 6)  # Chessboard pattern size (corners per row and column)
-    frame_size = (4608, 3456)   # Image size (width, height)
-
-    # Path where chessboard images are stored
-    chessboard_images_path = 'photos/camera calibration'
+    parser.add_argument("--images", default='photos/camera calibration', help="Folder with the chessboard images")
+    parser.add_argument("--board", type=int, nargs=2, default=(8, 6), help="Inner corners per row and column")
+    parser.add_argument("--frame-size", type=int, nargs=2, default=(4608, 3456), help="Image width and height")
+    parser.add_argument("--output", default='camera_calibration.npz', help="Calibration file to write")
+    parser.add_argument("--workers", type=int, default=None, help="Corner detection processes, all cores by default")
+    parser.add_argument("--max-view-error", type=float, default=3.0, help="Reject views above this error in pixels")
+    parser.add_argument("--show", action="store_true", help="Show the detected corners and an undistorted sample")
+    args = parser.parse_args()
 
     # Step 1: Calibrate the camera
-    camera_matrix, dist_coeffs = camera_calibration(chessboard_size, frame_size, chessboard_images_path)
-
-    if camera_matrix is not None and dist_coeffs is not None:
-        # Step 2: Load an image to undistort
-        distorted_image_path = 'photos/YDXJ0016.JPG'
-        undistorted_image = undistort_image(distorted_image_path, camera_matrix, dist_coeffs)
-
-        # Display the original and undistorted images
-        cv2.imshow("Distorted Image", cv2.imread(distorted_image_path))
-        cv2.imshow("Undistorted Image", undistorted_image)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
+    calibration = camera_calibration(tuple(args.board), tuple(args.frame_size), args.images,
+                                     args.workers, max_view_error=args.max_view_error, show=args.show)
+
+    if calibration is not None:
+        save_calibration(args.output, calibration)
+
+        if args.show:
+            # Step 2: Load an image to undistort
+            distorted_image_path = 'photos/YDXJ0016.JPG'
+            undistorted_image = undistort_image(distorted_image_path, calibration['camera_matrix'], calibration['dist_coeffs'])
+
+            # Display the original and undistorted images
+            cv2.imshow("Distorted Image", cv2.imread(distorted_image_path))
+            cv2.imshow("Undistorted Image", undistorted_image)
+            cv2.waitKey(0)
+            cv2.destroyAllWindows()
     else:
-        print("Camera calibration failed.")  
+        print("Camera calibration failed.")
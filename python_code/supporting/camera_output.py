@@ -1,53 +1,492 @@
-#This function capture one frame from the video frame and undistort the image with second function
+#This module keeps the camera open on a background thread and undistorts the captured frames
+import sys
+import time
+import argparse
+import threading
+from collections import deque
 import cv2
 import numpy as np
 
+from supporting.camera_calibration import CALIBRATION_VERSION
 
-def capture_one_frame():
-    # Initialize the webcam (0 is the default camera)
-    cap = cv2.VideoCapture(0)
-    
-    # Check if the webcam is opened correctly
-    if not cap.isOpened():
-        print("Could not open webcam")
+
+class CaptureProfile:
+    """
+    Capture format requested from the camera driver. Fields left as None keep the driver default.
+    """
+
+    def __init__(self, fourcc=None, width=None, height=None, fps=None, buffer_size=1):
+        self.fourcc = fourcc
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.buffer_size = buffer_size
+
+    def __repr__(self):
+        return (f"CaptureProfile({self.fourcc}, {self.width}x{self.height}, "
+                f"fps={self.fps}, buffer={self.buffer_size})")
+
+    def apply(self, cap):
+        # FOURCC has to be set before the resolution for V4L2 to pick the compressed modes
+        if self.fourcc:
+            cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*self.fourcc))
+        if self.width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        if self.fps:
+            cap.set(cv2.CAP_PROP_FPS, self.fps)
+        if self.buffer_size:
+            # A short driver queue keeps the frames we read close to real time
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, self.buffer_size)
+
+    def is_honored(self, cap):
+        # Check what the driver actually gave us, since unsupported settings are silently ignored
+        fourcc = decode_fourcc(cap.get(cv2.CAP_PROP_FOURCC))
+        if self.fourcc and fourcc and fourcc != self.fourcc:
+            return False
+        if self.width and int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) != self.width:
+            return False
+        if self.height and int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) != self.height:
+            return False
+        return True
+
+
+def decode_fourcc(value):
+    value = int(value)
+    if value <= 0:
+        return ""
+    return "".join(chr((value >> 8 * i) & 0xFF) for i in range(4))
+
+
+# Profiles the benchmark tries, cheapest to decode that still feeds the 640x480 model first
+CAPTURE_PROFILES = {
+    'mjpg-640x480': CaptureProfile('MJPG', 640, 480, 30),
+    'yuyv-640x480': CaptureProfile('YUYV', 640, 480, 30),
+    'mjpg-1280x720': CaptureProfile('MJPG', 1280, 720, 30),
+    'yuyv-1280x720': CaptureProfile('YUYV', 1280, 720, 10),
+    'mjpg-1920x1080': CaptureProfile('MJPG', 1920, 1080, 30),
+}
+DEFAULT_PROFILE = CAPTURE_PROFILES['mjpg-640x480']
+
+
+def open_capture(source, profile=None):
+    # Device indices may be passed as strings from the command line
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if cap.isOpened() and profile is not None:
+        profile.apply(cap)
+    return cap
+
+
+class CameraCapture:
+    """
+    Long-lived webcam capture. A grabber thread keeps the device open and always
+    holds the newest frame together with its monotonic timestamp and frame counter.
+    Frames handed out are shared with other readers, copy them before drawing on them.
+    With history > 0 the last few frames are kept as well, for pairing frames across cameras.
+    """
+
+    def __init__(self, index=0, profile=DEFAULT_PROFILE, history=0):
+        self.index = index
+        self.profile = profile
+        self.history = deque(maxlen=history) if history > 0 else None
+        self.cap = None
+        self.cap_lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.condition = threading.Condition()
+        self.frame = None
+        self.timestamp = 0.0
+        self.seq = 0
+
+    def start(self):
+        if self.running:
+            return self
+
+        self.cap = open_capture(self.index, self.profile)
+        if not self.cap.isOpened():
+            print(f"Could not open webcam {self.index}")
+            self.cap.release()
+            self.cap = None
+            return self
+
+        self.running = True
+        self.thread = threading.Thread(target=self._grab_loop, name=f"camera-{self.index}", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=2.0)
+            self.thread = None
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+        # Wake up anyone still waiting in next_after()
+        with self.condition:
+            self.condition.notify_all()
+
+    def is_opened(self):
+        return self.running and self.cap is not None
+
+    def _grab_loop(self):
+        failures = 0
+        while self.running:
+            with self.cap_lock:
+                ret, frame = self.cap.read()
+            if not ret:
+                # Back off while the camera is gone, up to half a second, and say so once a second at most
+                failures += 1
+                delay = min(0.01 * 2 ** min(failures - 1, 6), 0.5)
+                if failures == 1 or failures % max(1, int(1.0 / delay)) == 0:
+                    print(f"Failed to capture image from webcam {self.index} ({failures} failed reads)")
+                time.sleep(delay)
+                continue
+            if failures:
+                print(f"Webcam {self.index} delivering frames again after {failures} failed reads")
+                failures = 0
+
+            with self.condition:
+                self.frame = frame
+                self.timestamp = time.monotonic()
+                self.seq += 1
+                if self.history is not None:
+                    self.history.append((self.seq, self.timestamp, frame))
+                self.condition.notify_all()
+
+    def set_property(self, prop, value):
+        """
+        Set a cv2.CAP_PROP_* control on the open device. Returns True only if the
+        driver accepted it and reports the new value back.
+        """
+        if self.cap is None:
+            return False
+        with self.cap_lock:
+            if not self.cap.set(prop, value):
+                return False
+            return abs(self.cap.get(prop) - value) < 1.0
+
+    def get_property(self, prop):
+        if self.cap is None:
+            return None
+        with self.cap_lock:
+            return self.cap.get(prop)
+
+    def latest(self):
+        """
+        Return (seq, timestamp, frame) for the newest frame without blocking,
+        or None if nothing has been captured yet.
+        """
+        with self.condition:
+            if self.frame is None:
+                return None
+            return self.seq, self.timestamp, self.frame
+
+    def next_after(self, seq, timeout=1.0):
+        """
+        Block until a frame newer than `seq` is available and return (seq, timestamp, frame).
+        Returns None on timeout or when the capture is stopped.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.seq <= seq:
+                remaining = deadline - time.monotonic()
+                if not self.running or remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+            return self.seq, self.timestamp, self.frame
+
+    def recent(self):
+        # Copy of the kept history as a list of (seq, timestamp, frame), oldest first
+        with self.condition:
+            if self.history is None:
+                return [(self.seq, self.timestamp, self.frame)] if self.frame is not None else []
+            return list(self.history)
+
+
+# One shared capture per device index so every window in the process reuses the open camera
+_cameras = {}
+_cameras_lock = threading.Lock()
+
+
+def get_camera(index=0, profile=DEFAULT_PROFILE):
+    with _cameras_lock:
+        camera = _cameras.get(index)
+        if camera is None or not camera.is_opened():
+            camera = CameraCapture(index, profile).start()
+            _cameras[index] = camera
+        return camera
+
+
+def release_cameras():
+    with _cameras_lock:
+        for camera in _cameras.values():
+            camera.stop()
+        _cameras.clear()
+
+
+def capture_one_frame(index=0, timeout=1.0):
+    # Return the newest frame from the shared camera, waiting for the first one after startup
+    camera = get_camera(index)
+    if not camera.is_opened():
         return None
-    
-    # Read a single frame
-    ret, frame = cap.read()
-    
-    # Release the webcam
-    cap.release()
-    
-    # Check if the frame was captured successfully
-    if ret:
-        return frame
+
+    latest = camera.latest()
+    if latest is None:
+        latest = camera.next_after(0, timeout)
+
+    if latest is not None:
+        return latest[2]
     else:
         print("Failed to capture image")
         return None
 
 
+# Calibration written by supporting/camera_calibration.py
+CALIBRATION_FILE = 'camera_calibration.npz'
+
+# Fallback values from the original calibration of the action camera at 4608x3456
+DEFAULT_CAMERA_MATRIX = np.array([
+    [1.98739085e+03, 0.00000000e+00, 2.30406719e+03],
+    [0.00000000e+00, 1.97195676e+03, 1.63585773e+03],
+    [0.00000000e+00, 0.00000000e+00, 1.00000000e+00]
+])
+DEFAULT_DIST_COEFFS = np.array([[-0.21450995, 0.03875602, 0.00168561, -0.00679188, 0.02712468]])
+DEFAULT_FRAME_SIZE = (4608, 3456)
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    """
+    Load (camera_matrix, dist_coeffs, frame_size) from a calibration file,
+    falling back to the built-in values if the file does not exist.
+    """
+    try:
+        data = np.load(path)
+    except FileNotFoundError:
+        print(f"Calibration file {path} not found, using default camera matrix")
+        return DEFAULT_CAMERA_MATRIX, DEFAULT_DIST_COEFFS, DEFAULT_FRAME_SIZE
+
+    version = int(data['version']) if 'version' in data else 0
+    if version > CALIBRATION_VERSION:
+        print(f"Calibration file {path} has version {version}, newer than supported {CALIBRATION_VERSION}")
+        return DEFAULT_CAMERA_MATRIX, DEFAULT_DIST_COEFFS, DEFAULT_FRAME_SIZE
+
+    frame_size = tuple(int(v) for v in data['frame_size']) if 'frame_size' in data else DEFAULT_FRAME_SIZE
+    return data['camera_matrix'], data['dist_coeffs'], frame_size
+
+
+class Undistorter:
+    """
+    Undistorts frames with cv2.remap. The remap tables are built once per (width, height)
+    and the output is written into a preallocated buffer, so the returned image is
+    overwritten by the next call for the same frame size.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, frame_size=DEFAULT_FRAME_SIZE, alpha=1, calibrated=True):
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64)
+        self.frame_size = frame_size
+        self.alpha = alpha
+        # False when built from the fallback values, which belong to another camera
+        self.calibrated = calibrated
+        self.matrices = {}
+        self.maps = {}
+        self.buffers = {}
+
+    @classmethod
+    def from_file(cls, path=CALIBRATION_FILE, alpha=1):
+        camera_matrix, dist_coeffs, frame_size = load_calibration(path)
+        return cls(camera_matrix, dist_coeffs, frame_size, alpha, camera_matrix is not DEFAULT_CAMERA_MATRIX)
+
+    def matrix_for(self, width, height):
+        # Scale the calibrated matrix when the camera runs at a different resolution
+        calib_w, calib_h = self.frame_size
+        matrix = self.camera_matrix.copy()
+        matrix[0, :] *= width / calib_w
+        matrix[1, :] *= height / calib_h
+        matrix[2, :] = self.camera_matrix[2, :]
+        return matrix
+
+    def optimal_matrix_for(self, width, height):
+        key = (width, height)
+        if key not in self.matrices:
+            matrix = self.matrix_for(width, height)
+            new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(
+                matrix, self.dist_coeffs, (width, height), self.alpha, (width, height)
+            )
+            self.matrices[key] = (matrix, new_camera_matrix, roi)
+        return self.matrices[key]
+
+    def maps_for(self, width, height):
+        key = (width, height)
+        if key not in self.maps:
+            matrix, new_camera_matrix, roi = self.optimal_matrix_for(width, height)
+            # Fixed-point maps are smaller and faster to remap with than float maps
+            map1, map2 = cv2.initUndistortRectifyMap(
+                matrix, self.dist_coeffs, None, new_camera_matrix, (width, height), cv2.CV_16SC2
+            )
+            self.maps[key] = (map1, map2, roi, new_camera_matrix)
+        return self.maps[key]
+
+    def undistort_points(self, points, width, height, crop=True):
+        """
+        Map (x, y) pixel coordinates of a raw width x height frame into the coordinates
+        of the cropped image undistort() would return. With crop=False they are projected
+        with the camera matrix of the raw frame instead, keeping its centre and pixel scale,
+        which is what targets converted to angles as raw frame pixels need.
+        Returns an (N, 2) float array.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+        if len(points) == 0:
+            return np.empty((0, 2), dtype=np.float64)
+
+        matrix, new_camera_matrix, roi = self.optimal_matrix_for(width, height)
+        projection = new_camera_matrix if crop else matrix
+        undistorted = cv2.undistortPoints(points, matrix, self.dist_coeffs, P=projection).reshape(-1, 2)
+        if crop:
+            undistorted -= roi[:2]
+        return undistorted
+
+    def undistort_boxes(self, boxes, width, height, crop=True):
+        """
+        Correct (N, 4) x1, y1, x2, y2 boxes from a raw frame in one call.
+        Returns (boxes, centroids) in undistorted image coordinates, see undistort_points.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        x1, y1, x2, y2 = boxes.T
+
+        # Four corners plus the centroid of every box, undistorted together
+        points = np.stack([
+            np.stack([x1, y1], axis=1),
+            np.stack([x2, y1], axis=1),
+            np.stack([x2, y2], axis=1),
+            np.stack([x1, y2], axis=1),
+            np.stack([(x1 + x2) / 2, (y1 + y2) / 2], axis=1),
+        ], axis=1)
+        undistorted = self.undistort_points(points.reshape(-1, 2), width, height, crop).reshape(-1, 5, 2)
+
+        corners = undistorted[:, :4]
+        corrected = np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1)
+        return corrected, undistorted[:, 4]
+
+    def undistort(self, frame):
+        h, w = frame.shape[:2]
+        map1, map2, roi, _ = self.maps_for(w, h)
+
+        key = (frame.shape, frame.dtype)
+        out = self.buffers.get(key)
+        if out is None:
+            out = np.empty_like(frame)
+            self.buffers[key] = out
+        cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=out)
+
+        # Crop the image based on the region of interest (roi)
+        x, y, rw, rh = roi
+        return out[y:y + rh, x:x + rw]
+
+
+_undistorter = None
+
+
+def get_undistorter():
+    global _undistorter
+    if _undistorter is None:
+        _undistorter = Undistorter.from_file()
+    return _undistorter
+
+
 def undistort_image(frame):
+    return get_undistorter().undistort(frame)
+
+
+def benchmark_profile(source, profile, seconds=5.0, warmup=10):
+    """
+    Read frames from `source` with `profile` for `seconds` and return a dict with
+    sustained fps, mean decode CPU time per frame and mean frame age in milliseconds.
+    Returns None when the source cannot be opened or ignores the profile.
+    """
+    cap = open_capture(source, profile)
+    if not cap.isOpened():
+        cap.release()
+        return None
+
+    is_device = isinstance(source, int) or (isinstance(source, str) and source.isdigit())
+    if is_device and profile is not None and not profile.is_honored(cap):
+        cap.release()
+        return None
+
+    for _ in range(warmup):
+        cap.read()
+
+    frames = 0
+    cpu_time = 0.0
+    ages = []
+    start = time.monotonic()
+    while time.monotonic() - start < seconds:
+        cpu_start = time.process_time()
+        ret, frame = cap.read()
+        cpu_time += time.process_time() - cpu_start
+        if not ret:
+            break
+        frames += 1
+
+        # V4L2 stamps buffers with CLOCK_MONOTONIC, files report their media position instead
+        if is_device:
+            stamp_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+            age_ms = time.monotonic() * 1000.0 - stamp_ms
+            if 0.0 <= age_ms < 10000.0:
+                ages.append(age_ms)
+    elapsed = time.monotonic() - start
+
+    result = {
+        'fourcc': decode_fourcc(cap.get(cv2.CAP_PROP_FOURCC)),
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'frames': frames,
+        'fps': frames / elapsed if elapsed > 0 else 0.0,
+        'cpu_ms': 1000.0 * cpu_time / frames if frames else 0.0,
+        'age_ms': sum(ages) / len(ages) if ages else None,
+    }
+    cap.release()
+    return result
+
 
-    # Define the camera matrix with the specified values
-    camera_matrix = np.array([
-        [1.98739085e+03, 0.00000000e+00, 2.30406719e+03],
-        [0.00000000e+00, 1.97195676e+03, 1.63585773e+03],
-        [0.00000000e+00, 0.00000000e+00, 1.00000000e+00]
-    ])    
+def benchmark(source, profile_names=None, seconds=5.0):
+    profile_names = profile_names or list(CAPTURE_PROFILES)
+    is_device = isinstance(source, int) or (isinstance(source, str) and source.isdigit())
+    if not is_device:
+        # A recorded video has a fixed format, so there is only one thing to measure
+        profile_names = ['file']
 
-    dist_coeffs = np.array([[-0.21450995, 0.03875602, 0.00168561, -0.00679188, 0.02712468]])
+    print(f"{'profile':<16}{'format':<20}{'fps':>8}{'cpu ms':>10}{'age ms':>10}")
+    results = {}
+    for name in profile_names:
+        profile = CAPTURE_PROFILES.get(name) if is_device else None
+        result = benchmark_profile(source, profile, seconds)
+        if result is None:
+            print(f"{name:<16}not supported")
+            continue
+        results[name] = result
+        fmt = f"{result['fourcc'] or '?'} {result['width']}x{result['height']}"
+        age = f"{result['age_ms']:.1f}" if result['age_ms'] is not None else "n/a"
+        print(f"{name:<16}{fmt:<20}{result['fps']:>8.1f}{result['cpu_ms']:>10.2f}{age:>10}")
+    return results
 
-    img = frame
-    h, w = img.shape[:2]
-    
-    # Refine the camera matrix
-    new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, (w, h), 1, (w, h))
 
-    # Undistort the image
-    undistorted_img = cv2.undistort(img, camera_matrix, dist_coeffs, None, new_camera_matrix)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Camera capture tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
 
-    # Crop the image based on the region of interest (roi)
-    x, y, w, h = roi
-    undistorted_img = undistorted_img[y:y + h, x:x + w]
+    bench_parser = subparsers.add_parser("benchmark", help="Measure throughput of the capture profiles")
+    bench_parser.add_argument("--source", default="0", help="Camera index or path to a recorded video")
+    bench_parser.add_argument("--profiles", nargs="*", choices=list(CAPTURE_PROFILES), help="Profiles to try")
+    bench_parser.add_argument("--seconds", type=float, default=5.0, help="Measurement time per profile")
 
-    return undistorted_img
\ No newline at end of file
+    args = parser.parse_args()
+    if args.command == "benchmark":
+        if not benchmark(args.source, args.profiles, args.seconds):
+            sys.exit(1)
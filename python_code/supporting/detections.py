@@ -0,0 +1,132 @@
+#Detection results as NumPy arrays, shared by every script instead of its own copy of process_image_with_yolo
+import cv2
+import numpy as np
+
+# Box colour of the drawn detections, BGR
+DEFAULT_COLOR = (0, 255, 0)
+
+
+def box_overlap(a, b, metric='iou'):
+    """
+    (len(a), len(b)) overlap matrix of two x1, y1, x2, y2 box arrays. Metric 'iou' is the
+    intersection over union, 'ios' the intersection over the smaller of the two boxes.
+    """
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = ((a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]))[:, None]
+    area_b = ((b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]))[None, :]
+    if metric == 'ios':
+        return inter / np.maximum(np.minimum(area_a, area_b), 1e-9)
+    return inter / np.maximum(area_a + area_b - inter, 1e-9)
+
+
+def nms(boxes, scores, threshold, classes=None, max_det=None, metric='iou'):
+    """
+    Greedy non-maximum suppression, returns the indices of the kept boxes by descending score.
+    With `classes` boxes of different classes never suppress each other. See box_overlap
+    for `metric`.
+    """
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.intp)
+    if classes is not None:
+        # Shift every class to its own region so one pass handles all classes
+        boxes = boxes + (np.asarray(classes, dtype=np.float32) * (boxes.max() + 1))[:, None]
+
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while len(order) and (max_det is None or len(keep) < max_det):
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        order = rest[box_overlap(boxes[best:best + 1], boxes[rest], metric)[0] <= threshold]
+    return np.array(keep, dtype=np.intp)
+
+
+class Detections:
+    """
+    Detections of one frame in contiguous arrays: xyxy (N, 4) float32, score (N,) float32,
+    class_id (N,) int32 and centroid (N, 2) int32 box centres in whole pixels. Filtering
+    with a mask or index array, shifting and scaling work on all boxes at once and return
+    a new Detections.
+    """
+
+    __slots__ = ('xyxy', 'score', 'class_id', 'centroid', 'names')
+
+    def __init__(self, xyxy, score, class_id, names=None):
+        self.xyxy = np.ascontiguousarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.score = np.ascontiguousarray(score, dtype=np.float32).reshape(-1)
+        self.class_id = np.ascontiguousarray(class_id, dtype=np.int32).reshape(-1)
+        # Same rounding as the old int((x1 + x2) // 2)
+        self.centroid = np.floor((self.xyxy[:, :2] + self.xyxy[:, 2:]) / 2).astype(np.int32)
+        self.names = names or {}
+
+    @classmethod
+    def from_array(cls, data, names=None):
+        # From an (N, 6) array of x1, y1, x2, y2, score, class like results.boxes.data
+        if hasattr(data, 'cpu'):
+            data = data.cpu().numpy()
+        data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+        return cls(data[:, :4], data[:, 4], data[:, 5], names)
+
+    @classmethod
+    def from_result(cls, result):
+        # From an Ultralytics Results or an inference_backends.DetectionResult
+        return cls.from_array(result.boxes.data, result.names)
+
+    @classmethod
+    def empty(cls, names=None):
+        return cls(np.empty((0, 4)), np.empty(0), np.empty(0), names)
+
+    def __len__(self):
+        return len(self.score)
+
+    def __getitem__(self, index):
+        return Detections(self.xyxy[index], self.score[index], self.class_id[index], self.names)
+
+    @property
+    def data(self):
+        # (N, 6) array in the results.boxes.data layout
+        return np.concatenate([self.xyxy, self.score[:, None], self.class_id[:, None].astype(np.float32)], axis=1)
+
+    def above(self, threshold):
+        return self[self.score > threshold]
+
+    def of_class(self, *class_ids):
+        return self[np.isin(self.class_id, class_ids)]
+
+    def shift(self, dx, dy):
+        # Boxes of a crop moved to the frame the crop was taken at (dx, dy) from
+        if dx == 0 and dy == 0:
+            return self
+        return Detections(self.xyxy + np.array([dx, dy, dx, dy], dtype=np.float32), self.score, self.class_id, self.names)
+
+    def scale(self, sx, sy):
+        return Detections(self.xyxy * np.array([sx, sy, sx, sy], dtype=np.float32), self.score, self.class_id, self.names)
+
+    def draw(self, image, color=DEFAULT_COLOR, thickness=2, font_scale=0.5, label_score=True):
+        """
+        Draw boxes and labels on `image` in place and return it. `color` is one BGR tuple or
+        a dict of class_id to colour.
+        """
+        boxes = np.rint(self.xyxy).astype(np.int32).tolist()
+        for (x1, y1, x2, y2), score, class_id in zip(boxes, self.score.tolist(), self.class_id.tolist()):
+            box_color = color.get(class_id, DEFAULT_COLOR) if isinstance(color, dict) else color
+            label = self.names.get(class_id, str(class_id))
+            if label_score:
+                label = f"{label}: {score:.2f}"
+            cv2.rectangle(image, (x1, y1), (x2, y2), box_color, thickness)
+            cv2.putText(image, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, font_scale, box_color, thickness)
+        return image
+
+
+def detect(model, image, threshold=None, **kwargs):
+    """
+    Run the model on one image and return its Detections, optionally only those scoring
+    above `threshold`. Extra keyword arguments go to the model call.
+    """
+    detections = Detections.from_result(model(image, **kwargs)[0])
+    if threshold is not None:
+        detections = detections.above(threshold)
+    return detections
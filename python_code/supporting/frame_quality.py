@@ -0,0 +1,66 @@
+#Cheap pre-inference check that rejects blurred or badly exposed frames before they reach YOLO
+import cv2
+import numpy as np
+
+# Reasons a frame can be rejected, also the keys of the rejection counters
+BLURRED = "blurred"
+TOO_DARK = "too_dark"
+TOO_BRIGHT = "too_bright"
+CLIPPED = "clipped"
+
+
+class FrameQualityGate:
+    """
+    Scores a small grayscale copy of the frame. Sharpness is the variance of the
+    Laplacian, exposure the mean brightness and the share of pixels clipped at 0 or 255.
+    Thresholds are for the downscaled copy, so they do not depend on the camera resolution.
+    """
+
+    def __init__(self, min_sharpness=60.0, min_brightness=40.0, max_brightness=215.0,
+                 max_clipped=0.25, width=160):
+        self.min_sharpness = min_sharpness
+        self.min_brightness = min_brightness
+        self.max_brightness = max_brightness
+        self.max_clipped = max_clipped
+        self.width = width
+        self.checked = 0
+        self.rejected = {BLURRED: 0, TOO_DARK: 0, TOO_BRIGHT: 0, CLIPPED: 0}
+
+    def measure(self, frame):
+        # Downscale first, every statistic below is computed on a few thousand pixels
+        h, w = frame.shape[:2]
+        height = max(1, int(h * self.width / w))
+        small = cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+        sharpness = cv2.Laplacian(gray, cv2.CV_32F).var()
+        brightness = float(gray.mean())
+        clipped = float(np.count_nonzero((gray <= 2) | (gray >= 253))) / gray.size
+        return {'sharpness': float(sharpness), 'brightness': brightness, 'clipped': clipped}
+
+    def check(self, frame):
+        """
+        Return (ok, reason, scores). reason is None for usable frames, otherwise
+        one of BLURRED, TOO_DARK, TOO_BRIGHT or CLIPPED.
+        """
+        scores = self.measure(frame)
+        self.checked += 1
+
+        reason = None
+        if scores['brightness'] < self.min_brightness:
+            reason = TOO_DARK
+        elif scores['brightness'] > self.max_brightness:
+            reason = TOO_BRIGHT
+        elif scores['clipped'] > self.max_clipped:
+            reason = CLIPPED
+        elif scores['sharpness'] < self.min_sharpness:
+            reason = BLURRED
+
+        if reason is not None:
+            self.rejected[reason] += 1
+        return reason is None, reason, scores
+
+    def summary(self):
+        rejected = sum(self.rejected.values())
+        return f"Quality gate: {rejected}/{self.checked} frames rejected " + \
+            ", ".join(f"{reason} {count}" for reason, count in self.rejected.items())
@@ -0,0 +1,176 @@
+#Shared-memory ring of frame slots so capture, inference and display can run in separate processes
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+from supporting.camera_output import open_capture, DEFAULT_PROFILE
+
+# Ring header, padded to one cache line
+RING_HEADER = np.dtype([
+    ('write_seq', np.uint64),
+    ('slots', np.uint32),
+    ('height', np.uint32),
+    ('width', np.uint32),
+    ('channels', np.uint32),
+])
+RING_HEADER_SIZE = 64
+
+# Per-slot header. seq is 0 while the slot is being written
+SLOT_HEADER = np.dtype([
+    ('seq', np.uint64),
+    ('timestamp', np.float64),
+    ('meta', np.float64, (4,)),
+])
+
+
+class FrameRing:
+    """
+    Fixed-size frame slots in a multiprocessing.shared_memory block. One process writes,
+    any number of processes attach by name and read the frames as numpy views without copying.
+    A slot is reused after `slots` newer frames, so readers that hold on to a view should
+    check still_valid() before trusting what they computed from it.
+    """
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.header = np.ndarray((1,), dtype=RING_HEADER, buffer=shm.buf)[0]
+        self.slots = int(self.header['slots'])
+        self.shape = (int(self.header['height']), int(self.header['width']), int(self.header['channels']))
+
+        offset = RING_HEADER_SIZE
+        self.slot_headers = np.ndarray((self.slots,), dtype=SLOT_HEADER, buffer=shm.buf, offset=offset)
+        offset += self.slots * SLOT_HEADER.itemsize
+        self.data = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+        self.next_seq = int(self.header['write_seq']) + 1
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @classmethod
+    def create(cls, shape=(480, 640, 3), slots=4, name=None):
+        height, width, channels = shape
+        size = RING_HEADER_SIZE + slots * SLOT_HEADER.itemsize + slots * height * width * channels
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray((1,), dtype=RING_HEADER, buffer=shm.buf)
+        header[0] = (0, slots, height, width, channels)
+        slot_headers = np.ndarray((slots,), dtype=SLOT_HEADER, buffer=shm.buf, offset=RING_HEADER_SIZE)
+        slot_headers['seq'] = 0
+        del header, slot_headers
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        # Only the creating process may unlink the block, so readers opt out of tracking where supported
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+        return cls(shm, owner=False)
+
+    def close(self):
+        # Drop our numpy views first, the buffer cannot be closed while they exist
+        self.header = self.slot_headers = self.data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # Writer side
+
+    def begin_write(self):
+        """
+        Reserve the next slot and return (slot, view) to fill in place, for example with
+        cap.read(view). Call commit() when the frame is complete.
+        """
+        slot = self.next_seq % self.slots
+        self.slot_headers[slot]['seq'] = 0
+        return slot, self.data[slot]
+
+    def commit(self, slot, timestamp, meta=None):
+        header = self.slot_headers[slot]
+        header['timestamp'] = timestamp
+        header['meta'] = meta if meta is not None else 0.0
+        header['seq'] = self.next_seq
+        self.header['write_seq'] = self.next_seq
+        self.next_seq += 1
+        return int(header['seq'])
+
+    def write(self, frame, timestamp=None, meta=None):
+        slot, view = self.begin_write()
+        np.copyto(view, frame)
+        return self.commit(slot, time.monotonic() if timestamp is None else timestamp, meta)
+
+    # Reader side
+
+    def latest_seq(self):
+        return int(self.header['write_seq'])
+
+    def read(self, seq):
+        """
+        Return (seq, timestamp, frame_view, meta) for frame `seq`, or None if it
+        has not been written yet or its slot was already reused.
+        """
+        if seq <= 0:
+            return None
+        header = self.slot_headers[seq % self.slots]
+        if int(header['seq']) != seq:
+            return None
+        return seq, float(header['timestamp']), self.data[seq % self.slots], header['meta'].copy()
+
+    def read_latest(self):
+        return self.read(self.latest_seq())
+
+    def still_valid(self, seq):
+        return int(self.slot_headers[seq % self.slots]['seq']) == seq
+
+    def wait_after(self, seq, timeout=1.0, poll=0.001):
+        # Poll the shared write counter until a frame newer than `seq` is published
+        deadline = time.monotonic() + timeout
+        while True:
+            latest = self.latest_seq()
+            if latest > seq:
+                item = self.read(latest)
+                if item is not None:
+                    return item
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll)
+
+
+def capture_to_ring(ring_name, index=0, profile=DEFAULT_PROFILE, stop_event=None):
+    """
+    Target for a capture process: decode camera frames straight into the ring slots
+    until `stop_event` is set.
+    """
+    ring = FrameRing.attach(ring_name)
+    cap = open_capture(index, profile)
+    if not cap.isOpened():
+        print(f"Could not open webcam {index}")
+        ring.close()
+        return
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            slot, view = ring.begin_write()
+            ret, frame = cap.read(view)
+            if not ret:
+                time.sleep(0.01)
+                continue
+            if frame.shape != ring.shape:
+                print(f"Frame shape {frame.shape} does not match ring shape {ring.shape}")
+                break
+            # OpenCV decodes into the slot when the layout matches, otherwise copy it over once
+            if not np.shares_memory(frame, view):
+                np.copyto(view, frame)
+            ring.commit(slot, time.monotonic())
+    finally:
+        cap.release()
+        ring.close()
@@ -0,0 +1,170 @@
+#Frame sources for the detection loops: the live camera, a recorded video or a folder of images
+import os
+import time
+import cv2
+
+from supporting.camera_output import get_camera
+
+
+class FrameSource:
+    """
+    Common interface of all frame sources. read() returns (seq, timestamp, frame)
+    for the next frame, or None if no frame arrived within `timeout` or the source is exhausted.
+    """
+
+    def read(self, timeout=1.0):
+        raise NotImplementedError
+
+    def is_finished(self):
+        return False
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        while not self.is_finished():
+            item = self.read()
+            if item is not None:
+                yield item
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CameraSource(FrameSource):
+    def __init__(self, index=0):
+        self.camera = get_camera(index)
+        self.last_seq = 0
+
+    def read(self, timeout=1.0):
+        if timeout <= 0:
+            latest = self.camera.latest()
+            if latest is None or latest[0] == self.last_seq:
+                return None
+        else:
+            latest = self.camera.next_after(self.last_seq, timeout)
+            if latest is None:
+                return None
+        self.last_seq = latest[0]
+        return latest
+
+    def is_finished(self):
+        return not self.camera.is_opened()
+
+
+class ReplaySource(FrameSource):
+    """
+    Base for recorded sources. With realtime=True frames are released at the pace of
+    their original timestamps, otherwise they are returned as fast as they can be read.
+    """
+
+    def __init__(self, realtime=False):
+        self.realtime = realtime
+        self.seq = 0
+        self.finished = False
+        self.pending = None
+        self.first_timestamp = None
+        self.start_time = None
+
+    def next_frame(self):
+        # Subclasses return (timestamp, frame) or None when there are no more frames
+        raise NotImplementedError
+
+    def read(self, timeout=1.0):
+        if self.pending is None:
+            if self.finished:
+                return None
+            item = self.next_frame()
+            if item is None:
+                self.finished = True
+                return None
+            self.seq += 1
+            self.pending = (self.seq, item[0], item[1])
+
+        if self.realtime:
+            timestamp = self.pending[1]
+            if self.first_timestamp is None:
+                self.first_timestamp = timestamp
+                self.start_time = time.monotonic()
+            due = self.start_time + (timestamp - self.first_timestamp)
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(min(wait, max(timeout, 0)))
+                if time.monotonic() < due:
+                    return None
+
+        item, self.pending = self.pending, None
+        return item
+
+    def is_finished(self):
+        return self.finished and self.pending is None
+
+
+class VideoFileSource(ReplaySource):
+    def __init__(self, path, realtime=False):
+        super().__init__(realtime)
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            print(f"Could not open video {path}")
+            self.finished = True
+
+    def next_frame(self):
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        # Media position of the decoded frame, in seconds
+        return self.cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, frame
+
+    def close(self):
+        self.cap.release()
+
+
+class ImageFolderSource(ReplaySource):
+    """
+    Replays the images of a folder in file name order. The file modification time is
+    used as the original timestamp, or a fixed `fps` if one is given.
+    """
+
+    valid_extensions = (".jpg", ".jpeg", ".png", ".bmp")
+
+    def __init__(self, folder, realtime=False, fps=None):
+        super().__init__(realtime)
+        self.folder = folder
+        self.fps = fps
+        self.image_files = sorted(f for f in os.listdir(folder) if f.lower().endswith(self.valid_extensions))
+        self.index = 0
+        if not self.image_files:
+            print(f"No images found in {folder}")
+            self.finished = True
+
+    def next_frame(self):
+        while self.index < len(self.image_files):
+            path = os.path.join(self.folder, self.image_files[self.index])
+            self.index += 1
+            frame = cv2.imread(path)
+            if frame is None:
+                print(f"Failed to read {path}")
+                continue
+            if self.fps:
+                timestamp = (self.index - 1) / self.fps
+            else:
+                timestamp = os.path.getmtime(path)
+            return timestamp, frame
+        return None
+
+
+def open_source(spec="0", realtime=False):
+    """
+    Open a frame source from a command line style spec: a camera index,
+    a folder of images or a video file.
+    """
+    spec = str(spec)
+    if spec.isdigit():
+        return CameraSource(int(spec))
+    if os.path.isdir(spec):
+        return ImageFolderSource(spec, realtime)
+    return VideoFileSource(spec, realtime)
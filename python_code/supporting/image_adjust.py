@@ -0,0 +1,137 @@
+#Camera setting sliders: zoom crop, and brightness and saturation set on the camera or applied with lookup tables
+import cv2
+import numpy as np
+
+# Written far outside any control range to find the range, drivers clamp it to the nearest limit
+PROBE_VALUE = 100000
+
+IDENTITY_LUT = np.arange(256, dtype=np.uint8)
+
+
+def brightness_lut(value):
+    # Slider 50 is neutral, every step adds or removes one grey level like the old beta offset
+    return np.clip(IDENTITY_LUT.astype(np.int16) + (value - 50), 0, 255).astype(np.uint8)
+
+
+def saturation_lut(value):
+    # Slider 50 is neutral, 0 removes all colour and 100 doubles the HSV saturation
+    return np.clip(IDENTITY_LUT * (value / 50.0), 0, 255).astype(np.uint8)
+
+
+class ImageAdjuster:
+    """
+    Applies the brightness and saturation sliders. Each slider is first tried on the camera
+    itself, so the adjustment costs nothing per frame. If the device does not support the
+    control, a 256 entry table is built when the slider moves and applied with cv2.LUT.
+    The sliders are mapped onto the range the device reports, like 0-255 or -64..64, and
+    restore() puts the controls back to the values they had before the first change.
+    """
+
+    def __init__(self, camera=None):
+        self.camera = camera
+        self.brightness = 50
+        self.saturation = 50
+        self.software_brightness = False
+        self.software_saturation = False
+        self.bgr_lut = None
+        self.hsv_lut = None
+        self.ranges = {}
+        self.originals = {}
+
+    def device_range(self, prop):
+        """
+        (low, high) of a camera control, or None when it can not be found. The values read
+        back after writing far below and far above the range are its limits, the control is
+        set back to its original value afterwards. A driver that rejects the writes instead
+        of clamping them leaves low equal to high, the slider is then done in software.
+        """
+        if prop in self.ranges:
+            return self.ranges[prop]
+        span = None
+        original = self.camera.get_property(prop)
+        if original is not None:
+            self.originals.setdefault(prop, original)
+            self.camera.set_property(prop, -PROBE_VALUE)
+            low = self.camera.get_property(prop)
+            self.camera.set_property(prop, PROBE_VALUE)
+            high = self.camera.get_property(prop)
+            self.camera.set_property(prop, original)
+            if low is not None and high is not None and high > low:
+                span = (low, high)
+        self.ranges[prop] = span
+        return span
+
+    def set_on_camera(self, prop, value):
+        if self.camera is None:
+            return False
+        span = self.device_range(prop)
+        if span is None:
+            return False
+        low, high = span
+        if self.camera.set_property(prop, round(low + (high - low) * value / 100.0)):
+            return True
+        # Not taken as asked, put the original value back so the lookup table is not applied on top of it
+        self.camera.set_property(prop, self.originals[prop])
+        return False
+
+    def restore(self):
+        # Controls back to the values they had before the sliders moved, called when the window closes
+        if self.camera is not None:
+            for prop, value in self.originals.items():
+                self.camera.set_property(prop, value)
+
+    def set_brightness(self, value):
+        self.brightness = value
+        self.software_brightness = not self.set_on_camera(cv2.CAP_PROP_BRIGHTNESS, value)
+        self.rebuild_luts()
+
+    def set_saturation(self, value):
+        self.saturation = value
+        self.software_saturation = not self.set_on_camera(cv2.CAP_PROP_SATURATION, value)
+        self.rebuild_luts()
+
+    def rebuild_luts(self):
+        brightness = self.software_brightness and self.brightness != 50
+        saturation = self.software_saturation and self.saturation != 50
+
+        self.bgr_lut = None
+        self.hsv_lut = None
+        if saturation:
+            # One pass in HSV: hue untouched, saturation scaled, brightness shifted on V
+            value_lut = brightness_lut(self.brightness) if brightness else IDENTITY_LUT
+            self.hsv_lut = np.dstack([IDENTITY_LUT, saturation_lut(self.saturation), value_lut])
+        elif brightness:
+            self.bgr_lut = brightness_lut(self.brightness)
+
+    def apply(self, frame, pool=None):
+        """
+        Return the adjusted frame. With a BufferPool the result is written into pooled
+        buffers, otherwise new arrays are returned. Neutral sliders return the frame itself.
+        """
+        if self.bgr_lut is None and self.hsv_lut is None:
+            return frame
+
+        out = pool.like("adjusted", frame) if pool is not None else np.empty_like(frame)
+        if self.bgr_lut is not None:
+            cv2.LUT(frame, self.bgr_lut, dst=out)
+            return out
+
+        hsv = pool.like("hsv", frame) if pool is not None else np.empty_like(frame)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2HSV, dst=hsv)
+        cv2.LUT(hsv, self.hsv_lut, dst=hsv)
+        cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=out)
+        return out
+
+
+def zoom_crop(frame, zoom_factor):
+    """
+    Return (crop, (x0, y0)) for the centre region shown at `zoom_factor`. The crop is a view
+    of the frame, add (x0, y0) to positions found in it to get full-frame coordinates.
+    """
+    if zoom_factor <= 1:
+        return frame, (0, 0)
+    height, width = frame.shape[:2]
+    center_x, center_y = width // 2, height // 2
+    radius_x, radius_y = width // (2 * zoom_factor), height // (2 * zoom_factor)
+    x0, y0 = center_x - radius_x, center_y - radius_y
+    return frame[y0:center_y + radius_y, x0:center_x + radius_x], (x0, y0)
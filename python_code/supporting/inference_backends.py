@@ -0,0 +1,166 @@
+#CPU inference backends behind the same call interface as the Ultralytics model
+import os
+import ast
+import cv2
+import numpy as np
+
+from supporting.detections import nms
+
+# Ultralytics defaults, so all backends keep the same detections
+DEFAULT_CONF = 0.25
+DEFAULT_IOU = 0.7
+MAX_DET = 300
+
+
+class Boxes:
+    # Mirrors results.boxes, data is an (N, 6) float32 array of x1, y1, x2, y2, score, class
+    def __init__(self, data):
+        self.data = data
+
+
+class DetectionResult:
+    """
+    Minimal stand-in for an Ultralytics Results object. Callers that use
+    results.boxes.data.tolist() and results.names work the same with every backend.
+    """
+
+    def __init__(self, data, names, orig_shape):
+        self.boxes = Boxes(data)
+        self.names = names
+        self.orig_shape = orig_shape
+
+
+def letterbox(image, size):
+    # Resize keeping the aspect ratio and pad to size x size like Ultralytics does
+    h, w = image.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = int(round(h * scale)), int(round(w * scale))
+    top, left = (size - nh) // 2, (size - nw) // 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[top:top + nh, left:left + nw] = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    return canvas, scale, (left, top)
+
+
+def postprocess(output, scale, pad, orig_shape, conf=DEFAULT_CONF, iou=DEFAULT_IOU):
+    """
+    Decode a raw YOLOv8 head output of shape (1, 4 + classes, anchors) into the (N, 6)
+    box array of the original image.
+    """
+    pred = output[0].T
+    class_scores = pred[:, 4:]
+    classes = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(pred)), classes]
+
+    mask = scores > conf
+    pred, classes, scores = pred[mask], classes[mask], scores[mask]
+
+    cx, cy, w, h = pred[:, 0], pred[:, 1], pred[:, 2], pred[:, 3]
+    boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+
+    # Undo the letterbox and clip to the original frame
+    boxes -= np.array([pad[0], pad[1], pad[0], pad[1]], dtype=np.float32)
+    boxes /= scale
+    boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, orig_shape[1])
+    boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, orig_shape[0])
+
+    keep = nms(boxes, scores, iou, classes, MAX_DET)
+    return np.concatenate([boxes[keep], scores[keep, None], classes[keep, None]], axis=1).astype(np.float32)
+
+
+def export_model(weights, fmt, imgsz=640, precision='fp32'):
+    """
+    Return the `fmt` ('onnx' or 'openvino') export of Ultralytics weights from the model
+    cache, exporting it on a miss. The cache key includes the hash of the weights, so
+    replaced weights are exported again instead of loading the old export.
+    """
+    from supporting.artifact_cache import get_cache
+    cache = get_cache()
+    misses = cache.misses
+    path = cache.get(weights, fmt, imgsz, precision)
+    print(f"{'Exported' if cache.misses > misses else 'Cached'} {fmt} model for {weights}: {path}")
+    return path
+
+
+def parse_names(text, fallback=None):
+    # Ultralytics stores the class names as the repr of a dict in the model metadata
+    try:
+        return {int(k): v for k, v in ast.literal_eval(text).items()}
+    except (ValueError, SyntaxError, AttributeError):
+        return fallback or {}
+
+
+class ExportedBackend:
+    """
+    Shared pre and post processing of the exported backends. Subclasses only run the
+    network on a (1, 3, imgsz, imgsz) float blob and return its raw output.
+    """
+
+    def __init__(self, imgsz):
+        self.imgsz = imgsz
+        self.names = {}
+
+    def run(self, blob):
+        raise NotImplementedError
+
+    def __call__(self, image, conf=DEFAULT_CONF, iou=DEFAULT_IOU, **kwargs):
+        # The exported graph has a fixed input size, so an imgsz argument is ignored here
+        if isinstance(image, (list, tuple)):
+            # Exported with batch size 1, so a batch runs image by image like Ultralytics returns it
+            return [self(single, conf, iou)[0] for single in image]
+        canvas, scale, pad = letterbox(image, self.imgsz)
+        blob = cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)
+        data = postprocess(self.run(blob), scale, pad, image.shape[:2], conf, iou)
+        return [DetectionResult(data, self.names, image.shape[:2])]
+
+
+class OnnxBackend(ExportedBackend):
+    def __init__(self, weights, imgsz=640, threads=None):
+        import onnxruntime as ort
+        super().__init__(imgsz)
+        path = weights if weights.endswith('.onnx') else export_model(weights, 'onnx', imgsz)
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        self.names = parse_names(self.session.get_modelmeta().custom_metadata_map.get('names', ''))
+
+    def run(self, blob):
+        return self.session.run(None, {self.input_name: blob})[0]
+
+
+class OpenVinoBackend(ExportedBackend):
+    def __init__(self, weights, imgsz=640):
+        from openvino.runtime import Core
+        super().__init__(imgsz)
+        folder = weights if os.path.isdir(weights) else export_model(weights, 'openvino', imgsz)
+        xml = [f for f in os.listdir(folder) if f.endswith('.xml')][0]
+
+        core = Core()
+        model = core.read_model(os.path.join(folder, xml))
+        self.compiled = core.compile_model(model, 'CPU', {'PERFORMANCE_HINT': 'LATENCY'})
+        self.output = self.compiled.output(0)
+
+        # The export writes the class names to a yaml next to the model, <stem>.yaml in
+        # Ultralytics 8.0.x and metadata.yaml in later versions
+        import yaml
+        for name in sorted(os.listdir(folder)):
+            if name.endswith('.yaml'):
+                with open(os.path.join(folder, name)) as f:
+                    data = yaml.safe_load(f)
+                names = data.get('names') if isinstance(data, dict) else None
+                if names:
+                    names = dict(enumerate(names)) if isinstance(names, list) else names
+                    self.names = {int(k): v for k, v in names.items()}
+                    break
+
+    def run(self, blob):
+        return self.compiled([blob])[self.output]
+
+
+BACKENDS = {
+    'onnx': OnnxBackend,
+    'openvino': OpenVinoBackend,
+}
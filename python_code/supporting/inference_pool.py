@@ -0,0 +1,215 @@
+#Runs the model in separate processes, so inference neither blocks the Qt thread nor holds its GIL
+import os
+import time
+import queue
+import itertools
+import threading
+import multiprocessing as mp
+from concurrent.futures import Future
+
+import numpy as np
+
+from supporting.detections import Detections
+
+# Worker processes for this run, each loads its own copy of the model
+DEFAULT_WORKERS = int(os.environ.get('USR_INFERENCE_WORKERS', 2))
+
+
+def worker_main(weights, backend, threads, target_ms, requests, results):
+    # Split the cores between the workers before torch or ONNX Runtime start their thread pools
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    from supporting.model_registry import get_model
+    from supporting.frame_ring import FrameRing
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+    model = get_model(weights, backend=backend)
+    if target_ms:
+        from supporting.adaptive_resolution import AdaptiveResolution
+        model = AdaptiveResolution(model, target_ms)
+    results.put(('ready', os.getpid(), dict(model.names)))
+
+    rings = {}
+    try:
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            request_id, frame, ref, kwargs = request
+            try:
+                if ref is not None:
+                    # Frame referenced in a FrameRing, copied out before the slot can be reused
+                    ring_name, seq = ref
+                    if ring_name not in rings:
+                        rings[ring_name] = FrameRing.attach(ring_name)
+                    ring = rings[ring_name]
+                    entry = ring.read(seq)
+                    frame = entry[2].copy() if entry is not None else None
+                    if frame is None or not ring.still_valid(seq):
+                        raise LookupError(f"Frame {seq} was overwritten in {ring_name} before it was read")
+                start = time.perf_counter()
+                result = model(frame, verbose=False, **kwargs)[0]
+                data = Detections.from_result(result).data
+                results.put((request_id, data, None, (time.perf_counter() - start) * 1000))
+            except Exception as e:
+                results.put((request_id, None, f"{type(e).__name__}: {e}", 0.0))
+    finally:
+        for ring in rings.values():
+            ring.close()
+
+
+class InferencePool:
+    """
+    `workers` processes that each load `weights` and answer detection requests.
+    submit() takes a frame, or the name of a FrameRing and a sequence number so the frame is
+    not pickled, and returns a Future of Detections. At most `max_in_flight` requests are
+    queued or running, submit() blocks for a free slot or, with block=False, returns None
+    so a live view can skip the frame instead of falling behind.
+    With `target_ms` every worker adapts its input size, see AdaptiveResolution.
+    """
+
+    def __init__(self, weights, workers=DEFAULT_WORKERS, max_in_flight=None, backend=None,
+                 target_ms=None, start_timeout=180):
+        self.workers = workers
+        self.max_in_flight = max_in_flight or 2 * workers
+        self.slots = threading.BoundedSemaphore(self.max_in_flight)
+        self.futures = {}
+        self.futures_lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.names = {}
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.latency_ms = 0.0
+
+        # Spawn on every platform, forking a process with Qt and torch threads is not safe
+        context = mp.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        self.processes = [
+            context.Process(target=worker_main, args=(weights, backend, threads, target_ms, self.requests, self.results),
+                            daemon=True)
+            for _ in range(workers)
+        ]
+        for process in self.processes:
+            process.start()
+
+        deadline = time.monotonic() + start_timeout
+        for _ in range(workers):
+            try:
+                tag, pid, names = self.results.get(timeout=max(0.1, deadline - time.monotonic()))
+            except queue.Empty:
+                self.close()
+                raise RuntimeError(f"Inference workers did not load {weights} within {start_timeout} s")
+            self.names = names
+        print(f"{workers} inference workers ready with {weights}, {threads} threads each")
+
+        self.collector = threading.Thread(target=self.collect, daemon=True)
+        self.collector.start()
+
+    def submit(self, frame=None, ring=None, seq=None, block=True, timeout=None, **kwargs):
+        if not self.slots.acquire(block, timeout):
+            self.skipped += 1
+            return None
+        future = Future()
+        request_id = next(self.ids)
+        with self.futures_lock:
+            self.futures[request_id] = future
+        ref = (ring, seq) if ring is not None else None
+        # The queue pickles in a background thread, copy so a reused buffer can not change under it
+        self.requests.put((request_id, None if ref else np.array(frame, copy=True), ref, kwargs))
+        return future
+
+    def collect(self):
+        # Hands the worker results to the futures, runs on a thread of the GUI process
+        while True:
+            message = self.results.get()
+            if message is None:
+                break
+            request_id, data, error, latency_ms = message
+            with self.futures_lock:
+                future = self.futures.pop(request_id, None)
+            self.slots.release()
+            if future is None:
+                continue
+            if error is not None:
+                self.failed += 1
+                future.set_exception(RuntimeError(error))
+            else:
+                self.completed += 1
+                self.latency_ms += latency_ms
+                future.set_result(Detections.from_array(data, self.names))
+
+    def in_flight(self):
+        with self.futures_lock:
+            return len(self.futures)
+
+    def close(self, timeout=5):
+        for _ in self.processes:
+            self.requests.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.results.put(None)
+        with self.futures_lock:
+            for future in self.futures.values():
+                future.cancel()
+            self.futures.clear()
+
+    def summary(self):
+        mean = self.latency_ms / self.completed if self.completed else 0.0
+        return (f"Inference pool: {self.workers} workers, {self.completed} frames done ({mean:.0f} ms each), "
+                f"{self.failed} failed, {self.skipped} skipped while all {self.max_in_flight} slots were busy")
+
+
+class AsyncResult:
+    # Detections of an earlier frame, with the frame they were found on and when it was sent
+    __slots__ = ('detections', 'frame', 'timestamp')
+
+    def __init__(self, detections, frame, timestamp):
+        self.detections = detections
+        self.frame = frame
+        self.timestamp = timestamp
+
+
+class AsyncDetector:
+    """
+    Detector for the Tracker and SceneChangeDetector that never waits for the pool. Called
+    with a frame it sends it to the pool when no request of its own is pending and returns
+    the last finished request once, or None while it is still running. The result is an
+    AsyncResult, since its detections are of the frame that was sent, one inference older
+    than the current one; the Tracker moves them to the current frame and the
+    SceneChangeDetector keys them to the frame they came from.
+    A result for a frame of another size, like before a zoom change, is dropped.
+    """
+
+    def __init__(self, pool, **kwargs):
+        self.pool = pool
+        self.kwargs = kwargs
+        self.pending = None
+        self.pending_frame = None
+        self.pending_time = None
+
+    def __call__(self, image):
+        result = None
+        if self.pending is not None and self.pending.done():
+            future, frame, timestamp = self.pending, self.pending_frame, self.pending_time
+            self.pending = self.pending_frame = None
+            if future.cancelled():
+                pass
+            elif future.exception() is not None:
+                print(f"Inference failed: {future.exception()}")
+            elif frame.shape == image.shape:
+                result = AsyncResult(future.result(), frame, timestamp)
+        if self.pending is None:
+            self.pending_time = time.monotonic()
+            self.pending = self.pool.submit(image, block=False, **self.kwargs)
+            if self.pending is not None:
+                # Kept with the request, the caller may reuse the buffer of `image`
+                self.pending_frame = np.array(image, copy=True)
+        return result
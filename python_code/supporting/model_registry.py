@@ -0,0 +1,73 @@
+#Loads every YOLO weights file once per process and warms it up before the first real frame
+import os
+import time
+import threading
+import numpy as np
+from ultralytics import YOLO
+
+from supporting.inference_backends import BACKENDS
+
+# Input shape of the camera frames, (height, width, channels)
+DEFAULT_INPUT_SHAPE = (480, 640, 3)
+
+# Backend for this run: 'torch' (Ultralytics/PyTorch), 'onnx' or 'openvino'
+DEFAULT_BACKEND = os.environ.get('USR_BACKEND', 'torch')
+
+
+class ModelHandle:
+    """
+    Shared handle to a loaded model. Calls are serialised with a lock, so the same
+    handle can be used from the GUI thread and worker threads. Other attributes,
+    like names, are read from the wrapped YOLO model.
+    """
+
+    def __init__(self, model, path, backend='torch'):
+        self.model = model
+        self.path = path
+        self.backend = backend
+        self.lock = threading.Lock()
+
+    def __call__(self, image, **kwargs):
+        with self.lock:
+            return self.model(image, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_model(path, warmup=2, input_shape=DEFAULT_INPUT_SHAPE, fuse=True, backend=None):
+    """
+    Return the shared handle for the weights at `path`, loading it on first use.
+    The first load fuses conv and batchnorm layers and runs `warmup` inferences on a
+    blank frame of `input_shape`, so the first camera frame runs at steady-state speed.
+    `backend` defaults to the USR_BACKEND environment variable, every backend returns
+    results with the same boxes.data layout.
+    """
+    backend = backend or DEFAULT_BACKEND
+    with _models_lock:
+        handle = _models.get((path, backend))
+        if handle is not None:
+            return handle
+
+        start = time.monotonic()
+        if backend == 'torch':
+            model = YOLO(path)
+            if fuse:
+                model.fuse()
+        elif backend in BACKENDS:
+            model = BACKENDS[backend](path)
+        else:
+            raise ValueError(f"Unknown inference backend {backend}, expected torch or one of {list(BACKENDS)}")
+
+        blank = np.zeros(input_shape, dtype=np.uint8)
+        for _ in range(warmup):
+            model(blank, verbose=False)
+        print(f"Loaded {path} with {backend} in {time.monotonic() - start:.1f} s ({warmup} warm-up runs)")
+
+        handle = ModelHandle(model, path, backend)
+        _models[(path, backend)] = handle
+        return handle
@@ -0,0 +1,121 @@
+#Synchronized capture from several cameras, paired into one frame set per cycle
+import time
+
+from supporting.camera_output import CameraCapture, DEFAULT_PROFILE
+
+
+class FrameSet:
+    """
+    Frames of all cameras for one cycle. frames holds (seq, timestamp, frame) per camera
+    in the order the cameras were given, skews the offset of each frame from the reference camera.
+    """
+
+    def __init__(self, frames, skews):
+        self.frames = frames
+        self.skews = skews
+        self.timestamp = frames[0][1]
+
+    def images(self):
+        return [frame for _, _, frame in self.frames]
+
+
+class MultiCameraCapture:
+    """
+    Opens every camera with its own grabber thread and pairs their frames by nearest
+    timestamp. The first camera is the reference, the others are matched to its frames
+    and a set is only handed out when every camera is within `tolerance` seconds.
+    """
+
+    def __init__(self, indices, tolerance=0.02, profile=DEFAULT_PROFILE, history=8):
+        self.indices = list(indices)
+        self.tolerance = tolerance
+        self.cameras = [CameraCapture(index, profile, history) for index in self.indices]
+        self.last_seqs = [0] * len(self.cameras)
+        self.stats = {
+            index: {'sets': 0, 'dropped': 0, 'unmatched': 0, 'skew_sum': 0.0, 'max_skew': 0.0}
+            for index in self.indices
+        }
+
+    def start(self):
+        for camera in self.cameras:
+            camera.start()
+        return self
+
+    def stop(self):
+        for camera in self.cameras:
+            camera.stop()
+
+    def is_opened(self):
+        return all(camera.is_opened() for camera in self.cameras)
+
+    def _closest(self, camera, timestamp, after_seq):
+        best = None
+        for item in camera.recent():
+            if item[0] <= after_seq:
+                continue
+            if best is None or abs(item[1] - timestamp) < abs(best[1] - timestamp):
+                best = item
+        return best
+
+    def read_set(self, timeout=1.0):
+        """
+        Return the next FrameSet, or None if the reference camera timed out or
+        some camera had no frame within the tolerance of the reference frame.
+        """
+        reference = self.cameras[0].next_after(self.last_seqs[0], timeout)
+        if reference is None:
+            return None
+        ref_timestamp = reference[1]
+
+        frames = [reference]
+        for i, camera in enumerate(self.cameras[1:], start=1):
+            match = self._closest(camera, ref_timestamp, self.last_seqs[i])
+
+            # The partner frame may still be in flight, give it one tolerance window to arrive
+            if match is None or match[1] < ref_timestamp - self.tolerance:
+                camera.next_after(match[0] if match else self.last_seqs[i], self.tolerance)
+                match = self._closest(camera, ref_timestamp, self.last_seqs[i])
+
+            if match is None or abs(match[1] - ref_timestamp) > self.tolerance:
+                self.stats[self.indices[i]]['unmatched'] += 1
+                self.last_seqs[0] = reference[0]
+                return None
+            frames.append(match)
+
+        skews = []
+        for i, (seq, timestamp, _) in enumerate(frames):
+            stats = self.stats[self.indices[i]]
+            skew = timestamp - ref_timestamp
+            stats['sets'] += 1
+            # Frames grabbed since the previous set that never made it into one
+            stats['dropped'] += max(seq - self.last_seqs[i] - 1, 0)
+            stats['skew_sum'] += abs(skew)
+            stats['max_skew'] = max(stats['max_skew'], abs(skew))
+            self.last_seqs[i] = seq
+            skews.append(skew)
+        return FrameSet(frames, skews)
+
+    def report(self):
+        # Per camera counters with the mean skew in milliseconds
+        report = {}
+        for index, stats in self.stats.items():
+            mean_skew = stats['skew_sum'] / stats['sets'] if stats['sets'] else 0.0
+            report[index] = {
+                'sets': stats['sets'],
+                'dropped': stats['dropped'],
+                'unmatched': stats['unmatched'],
+                'mean_skew_ms': 1000.0 * mean_skew,
+                'max_skew_ms': 1000.0 * stats['max_skew'],
+            }
+        return report
+
+
+if __name__ == "__main__":
+    # Quick check of the pairing with the first two cameras
+    capture = MultiCameraCapture([0, 1]).start()
+    start = time.monotonic()
+    while time.monotonic() - start < 10.0:
+        capture.read_set()
+    capture.stop()
+    for index, stats in capture.report().items():
+        print(f"Camera {index}: {stats}")
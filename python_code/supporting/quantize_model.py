@@ -0,0 +1,273 @@
+#Static INT8 quantization of the YOLO weights for ONNX Runtime, calibrated and checked on our own dataset
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import cv2
+import numpy as np
+
+from supporting.artifact_cache import get_cache, ultralytics_export
+from supporting.inference_backends import DEFAULT_CONF, OnnxBackend, letterbox
+from supporting.detections import box_overlap
+
+try:
+    from onnxruntime.quantization import CalibrationDataReader
+except ImportError:
+    CalibrationDataReader = object
+
+# Same layout as model_train_code/annotation_checker.py: images/ and labels/ with one YOLO .txt per image
+VALID_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# COCO style IoU thresholds, mAP50-95 is the mean over all of them
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+def load_dataset(folder):
+    image_dir = os.path.join(folder, "images")
+    label_dir = os.path.join(folder, "labels")
+    if not os.path.isdir(image_dir) or not os.path.isdir(label_dir):
+        raise ValueError(f"{folder} must contain 'images' and 'labels' subfolders")
+    items = []
+    for name in sorted(os.listdir(image_dir)):
+        if name.lower().endswith(VALID_EXTENSIONS):
+            label = os.path.join(label_dir, os.path.splitext(name)[0] + ".txt")
+            items.append((os.path.join(image_dir, name), label))
+    return items
+
+
+def split_dataset(items, calibration=200, holdout=0.2, seed=0):
+    """
+    Shuffle with a fixed seed and return (calibration, held_out). The held-out images are
+    never used for calibration, so the mAP comparison is not flattered by them.
+    """
+    order = np.random.default_rng(seed).permutation(len(items))
+    n_held = max(1, int(round(len(items) * holdout)))
+    held = [items[i] for i in order[:n_held]]
+    calib = [items[i] for i in order[n_held:n_held + calibration]]
+    if not calib:
+        raise ValueError(f"Only {len(items)} images, none left for calibration after the held-out split")
+    return calib, held
+
+
+def read_labels(label_path, width, height):
+    # YOLO lines "class x_center y_center width height", normalised, to pixel xyxy boxes
+    if not os.path.exists(label_path):
+        return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.int32)
+    rows = np.loadtxt(label_path, ndmin=2, dtype=np.float32)
+    if rows.size == 0:
+        return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.int32)
+    cx, cy, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    return np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1), rows[:, 0].astype(np.int32)
+
+
+class ImageCalibrationReader(CalibrationDataReader):
+    # Feeds the calibration images to ONNX Runtime with the same letterbox as the backends use
+    def __init__(self, items, imgsz, input_name):
+        self.items = items
+        self.imgsz = imgsz
+        self.input_name = input_name
+        self.index = 0
+
+    def get_next(self):
+        while self.index < len(self.items):
+            image = cv2.imread(self.items[self.index][0])
+            self.index += 1
+            if image is not None:
+                canvas, _, _ = letterbox(image, self.imgsz)
+                return {self.input_name: cv2.dnn.blobFromImage(canvas, 1 / 255.0, swapRB=True)}
+        return None
+
+    def rewind(self):
+        self.index = 0
+
+
+def head_nodes(model):
+    """
+    Names of the nodes in the last /model.N/ block, the detection head. Its box decoding
+    loses most accuracy in INT8, so it is left in float.
+    """
+    blocks = {}
+    for node in model.graph.node:
+        parts = node.name.split('/')
+        if len(parts) > 2 and parts[1].startswith('model.') and parts[1][6:].isdigit():
+            blocks.setdefault(int(parts[1][6:]), []).append(node.name)
+    return blocks[max(blocks)] if blocks else []
+
+
+def int8_exporter(calibration, exclude_head=True):
+    def export(weights, workdir, backend, imgsz, precision):
+        import onnx
+        from onnxruntime.quantization import QuantFormat, QuantType, quantize_static
+        from onnxruntime.quantization.shape_inference import quant_pre_process
+
+        fp32 = ultralytics_export(weights, workdir, 'onnx', imgsz, 'fp32')
+        prepared = os.path.join(workdir, 'prepared.onnx')
+        # The export has a fixed input size, so the symbolic shape pass (and its sympy dependency) is not needed
+        quant_pre_process(fp32, prepared, skip_symbolic_shape=True)
+        model = onnx.load(prepared)
+        reader = ImageCalibrationReader(calibration, imgsz, model.graph.input[0].name)
+
+        output = os.path.splitext(fp32)[0] + '_int8.onnx'
+        start = time.monotonic()
+        quantize_static(prepared, output, reader, quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                        nodes_to_exclude=head_nodes(model) if exclude_head else [])
+        print(f"Calibrated on {len(calibration)} images in {time.monotonic() - start:.0f} s")
+
+        # Keep the class names and other Ultralytics metadata the ONNX backend reads
+        quantized = onnx.load(output)
+        del quantized.metadata_props[:]
+        quantized.metadata_props.extend(onnx.load(fp32).metadata_props)
+        onnx.save(quantized, output)
+        os.remove(fp32)
+        os.remove(prepared)
+        return output
+    return export
+
+
+def quantize(weights, calibration, imgsz=640, exclude_head=True):
+    """
+    Return (int8_path, fp32_path) of the ONNX models for `weights`, both from the model cache.
+    The calibration images are part of the cache key, so a new calibration set quantizes again.
+    """
+    files = hashlib.sha256()
+    for image, _ in calibration:
+        files.update(f"{os.path.basename(image)}:{os.path.getsize(image)}\n".encode())
+    extra = {'calibration': files.hexdigest(), 'images': len(calibration), 'exclude_head': exclude_head}
+
+    cache = get_cache()
+    fp32 = cache.get(weights, 'onnx', imgsz, 'fp32')
+    int8 = cache.get(weights, 'onnx', imgsz, 'int8', int8_exporter(calibration, exclude_head), extra)
+    return int8, fp32
+
+
+def average_precision(recall, precision):
+    # 101 point interpolated area under the precision-recall curve, as in COCO
+    precision = np.concatenate([[0.0], precision, [0.0]])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    samples = np.linspace(0, 1, 101)
+    return float(np.mean(precision[np.searchsorted(recall, samples, side='left').clip(0, len(precision) - 1)]))
+
+
+def mean_average_precision(predictions, truths):
+    """
+    mAP at every IOU_THRESHOLDS value over the classes present in the ground truth.
+    predictions and truths are per-image lists of (boxes, scores, classes) and (boxes, classes).
+    Returns an array with one mAP per threshold.
+    """
+    classes = np.unique(np.concatenate([t[1] for t in truths])) if truths else []
+    per_class = []
+    for c in classes:
+        n_truth = sum(int((t[1] == c).sum()) for t in truths)
+        scores, hits = [], []
+        for (p_boxes, p_scores, p_classes), (t_boxes, t_classes) in zip(predictions, truths):
+            p_boxes, p_scores = p_boxes[p_classes == c], p_scores[p_classes == c]
+            t_boxes = t_boxes[t_classes == c]
+            order = np.argsort(-p_scores)
+            p_boxes, p_scores = p_boxes[order], p_scores[order]
+            # (predictions, thresholds) true positive flags, each truth matched once per threshold
+            tp = np.zeros((len(p_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+            if len(p_boxes) and len(t_boxes):
+                iou = box_overlap(p_boxes, t_boxes)
+                for k, threshold in enumerate(IOU_THRESHOLDS):
+                    taken = np.zeros(len(t_boxes), dtype=bool)
+                    for i in range(len(p_boxes)):
+                        candidates = np.where(~taken & (iou[i] >= threshold), iou[i], -1)
+                        j = int(candidates.argmax())
+                        if candidates[j] >= 0:
+                            taken[j] = True
+                            tp[i, k] = True
+            scores.append(p_scores)
+            hits.append(tp)
+
+        scores = np.concatenate(scores)
+        hits = np.concatenate(hits)[np.argsort(-scores, kind='stable')]
+        tp_sum = np.cumsum(hits, axis=0)
+        fp_sum = np.cumsum(~hits, axis=0)
+        recall = tp_sum / max(n_truth, 1)
+        precision = tp_sum / np.maximum(tp_sum + fp_sum, 1)
+        per_class.append([average_precision(recall[:, k], precision[:, k]) for k in range(len(IOU_THRESHOLDS))])
+    return np.mean(per_class, axis=0) if per_class else np.zeros(len(IOU_THRESHOLDS))
+
+
+def evaluate(backend, held_out, warmup=3, conf=DEFAULT_CONF):
+    """
+    mAP50, mAP50-95 and per image latency (letterbox, inference and NMS) of a backend on
+    the held-out images. mAP is taken at a near zero confidence threshold so the
+    precision-recall curve is complete, latency in a separate pass at the deployment
+    threshold `conf`, where NMS sees as few boxes as in use.
+    """
+    predictions, truths, latencies = [], [], []
+    for i, (image_path, label_path) in enumerate(held_out):
+        image = cv2.imread(image_path)
+        if image is None:
+            continue
+        if i == 0:
+            for _ in range(warmup):
+                backend(image, conf=conf)
+        data = backend(image, conf=0.001)[0].boxes.data
+        predictions.append((data[:, :4], data[:, 4], data[:, 5].astype(np.int32)))
+        truths.append(read_labels(label_path, image.shape[1], image.shape[0]))
+
+        start = time.perf_counter()
+        backend(image, conf=conf)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    maps = mean_average_precision(predictions, truths)
+    return {
+        'map50': float(maps[0]),
+        'map50_95': float(maps.mean()),
+        'latency_ms_median': float(np.median(latencies)),
+        'latency_ms_p90': float(np.percentile(latencies, 90)),
+        'latency_conf': conf,
+        'images': len(latencies),
+    }
+
+
+def compare(weights, dataset, calibration=200, holdout=0.2, imgsz=640, seed=0, exclude_head=True, threads=None):
+    calib, held = split_dataset(load_dataset(dataset), calibration, holdout, seed)
+    print(f"{len(calib)} calibration images, {len(held)} held-out images")
+    int8, fp32 = quantize(weights, calib, imgsz, exclude_head)
+
+    report = {'weights': weights, 'imgsz': imgsz, 'calibration_images': len(calib), 'models': {}}
+    for name, path in (('fp32', fp32), ('int8', int8)):
+        result = evaluate(OnnxBackend(path, imgsz, threads), held)
+        result['path'] = path
+        result['size_mb'] = os.path.getsize(path) / 1e6
+        report['models'][name] = result
+
+    print(f"{'':6}{'mAP50':>8}{'mAP50-95':>10}{'median ms':>11}{'p90 ms':>9}{'size MB':>9}")
+    for name, r in report['models'].items():
+        print(f"{name:6}{r['map50']:8.3f}{r['map50_95']:10.3f}{r['latency_ms_median']:11.1f}"
+              f"{r['latency_ms_p90']:9.1f}{r['size_mb']:9.1f}")
+    fp, q = report['models']['fp32'], report['models']['int8']
+    print(f"INT8: mAP50-95 {q['map50_95'] - fp['map50_95']:+.3f}, "
+          f"{fp['latency_ms_median'] / q['latency_ms_median']:.2f}x the FP32 speed")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Quantize YOLO weights to INT8 and compare with FP32")
+    parser.add_argument("weights", help="Ultralytics weights, e.g. novlast.pt")
+    parser.add_argument("dataset", help="Folder with images/ and labels/ subfolders")
+    parser.add_argument("--calibration", type=int, default=200, help="Calibration images")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of the dataset held out for the comparison")
+    parser.add_argument("--imgsz", type=int, default=640, help="Model input size")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the dataset split")
+    parser.add_argument("--quantize-head", action="store_true", help="Also quantize the detection head")
+    parser.add_argument("--threads", type=int, default=None, help="ONNX Runtime threads")
+    parser.add_argument("--output", default=None, help="Copy the INT8 model here")
+    parser.add_argument("--report", default=None, help="Write the comparison as JSON")
+    args = parser.parse_args()
+
+    report = compare(args.weights, args.dataset, args.calibration, args.holdout, args.imgsz,
+                     args.seed, not args.quantize_head, args.threads)
+    if args.output:
+        shutil.copy2(report['models']['int8']['path'], args.output)
+        print(f"INT8 model copied to {args.output}")
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,90 @@
+#Reuses the last detections while the camera sees the same scene, so the model only runs after something moved
+import time
+import cv2
+import numpy as np
+
+from supporting.detections import Detections, detect
+
+
+class SceneChangeDetector:
+    """
+    Keeps a tiny grayscale copy of the last frame the model ran on. A new frame whose mean
+    absolute difference to it is below `threshold` grey levels gets the previous detections
+    back instead of a new inference, as long as those are less than `max_age` seconds old.
+    A frame of another size, like a new zoom or work area, always runs the model.
+    """
+
+    def __init__(self, threshold=3.0, size=(32, 24), max_age=2.0):
+        self.threshold = threshold
+        self.size = size
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.last_difference = None
+        self.reset()
+
+    def reset(self):
+        # Forget the last inference, the next frame always runs the model
+        self.signature = None
+        self.shape = None
+        self.detections = None
+        self.inferred_at = 0.0
+
+    def signature_of(self, frame):
+        # Shrink first, converting 768 pixels to grey is cheaper than converting the full frame
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small.astype(np.int16)
+
+    def changed(self, frame, signature=None):
+        if self.signature is None or frame.shape != self.shape:
+            return True
+        if time.monotonic() - self.inferred_at > self.max_age:
+            return True
+        if signature is None:
+            signature = self.signature_of(frame)
+        self.last_difference = float(np.abs(signature - self.signature).mean())
+        return self.last_difference >= self.threshold
+
+    def detect(self, model, image, **kwargs):
+        """
+        Detections for `image`, from the model when the scene changed and from the last
+        inference otherwise. Keyword arguments go to detections.detect.
+        """
+        return self.run(lambda frame: detect(model, frame, **kwargs), image)
+
+    def run(self, detector, image):
+        """
+        Same as detect() with any `detector(image)` returning Detections. A detector that
+        returns None, like the AsyncDetector of the inference pool while it is busy, gets
+        the frame again next time and None is passed on. A late result of an earlier frame,
+        like the AsyncResult of the AsyncDetector, is kept under the signature and time of
+        the frame it was found on and passed on as it is, so it is only reused for frames
+        that look like that one.
+        """
+        signature = self.signature_of(image)
+        if not self.changed(image, signature):
+            self.hits += 1
+            return self.detections
+
+        result = detector(image)
+        if result is None:
+            return None
+        self.misses += 1
+        if isinstance(result, Detections):
+            self.detections = result
+            self.inferred_at = time.monotonic()
+        else:
+            self.detections = result.detections
+            signature = self.signature_of(result.frame)
+            self.inferred_at = result.timestamp
+        self.signature = signature
+        self.shape = image.shape
+        return result
+
+    def summary(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return "Scene change: no frames yet"
+        return f"Scene change: {self.hits} of {total} frames reused the last detections ({self.hits / total:.0%}), {self.misses} inferences"
@@ -0,0 +1,207 @@
+#Maps detection pixels to servo angles on the host, fitted from a short aiming calibration
+import sys
+import json
+import time
+import argparse
+import cv2
+import numpy as np
+
+TARGETING_FILE = 'targeting.json'
+
+# Servo limits used by the firmware
+ANGLE_X_RANGE = (0, 180)
+ANGLE_Y_RANGE = (52, 148)
+
+
+def poly_features(u, v, degree):
+    # Every u^i * v^j with i + j <= degree, one column per term
+    return np.stack([u ** i * v ** j for i in range(degree + 1) for j in range(degree + 1 - i)], axis=-1)
+
+
+class TargetingModel:
+    """
+    Polynomial in normalised pixel coordinates giving (angleX, angleY) for a frame of
+    `frame_size`. Points from frames of another size are rescaled first. After build_lut()
+    every conversion is a single table lookup instead of a polynomial evaluation.
+    """
+
+    def __init__(self, coeffs, degree, frame_size):
+        self.coeffs = np.asarray(coeffs, dtype=np.float64)
+        self.degree = degree
+        self.frame_size = tuple(frame_size)
+        self.lut = None
+
+    @classmethod
+    def linear(cls, frame_size=(640, 480)):
+        # Same mapping as the firmware map() calls, angle = low + (high - low) * pixel / size
+        coeffs = np.zeros((poly_features(np.zeros(1), np.zeros(1), 1).shape[-1], 2))
+        # Terms for degree 1 are ordered 1, v, u
+        coeffs[0] = [ANGLE_X_RANGE[0], ANGLE_Y_RANGE[0]]
+        coeffs[2, 0] = ANGLE_X_RANGE[1] - ANGLE_X_RANGE[0]
+        coeffs[1, 1] = ANGLE_Y_RANGE[1] - ANGLE_Y_RANGE[0]
+        return cls(coeffs, 1, frame_size)
+
+    @classmethod
+    def fit(cls, pixels, angles, frame_size, degree=2):
+        """
+        Least-squares fit from recorded aim points, pixels and angles both (N, 2).
+        Needs at least as many points as polynomial terms, 6 for degree 2.
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        angles = np.asarray(angles, dtype=np.float64).reshape(-1, 2)
+        features = poly_features(pixels[:, 0] / frame_size[0], pixels[:, 1] / frame_size[1], degree)
+        if len(pixels) < features.shape[1]:
+            raise ValueError(f"Degree {degree} needs at least {features.shape[1]} points, got {len(pixels)}")
+        coeffs, _, _, _ = np.linalg.lstsq(features, angles, rcond=None)
+        return cls(coeffs, degree, frame_size)
+
+    @classmethod
+    def load(cls, path=TARGETING_FILE, frame_size=(640, 480)):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            print(f"Targeting file {path} not found, using the linear firmware mapping")
+            return cls.linear(frame_size)
+        return cls(data['coeffs'], data['degree'], data['frame_size'])
+
+    def save(self, path=TARGETING_FILE, residuals=None):
+        data = {
+            'degree': self.degree,
+            'frame_size': list(self.frame_size),
+            'coeffs': self.coeffs.tolist(),
+            'created': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        if residuals is not None:
+            data['residual_deg'] = float(residuals)
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+        print(f"Targeting saved to {path}")
+
+    def evaluate(self, points):
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        features = poly_features(points[:, 0] / self.frame_size[0], points[:, 1] / self.frame_size[1], self.degree)
+        return features @ self.coeffs
+
+    def build_lut(self):
+        # Dense (height, width, 2) table of angles for every pixel of the calibrated frame size
+        width, height = self.frame_size
+        u, v = np.meshgrid(np.arange(width, dtype=np.float64), np.arange(height, dtype=np.float64))
+        self.lut = self.evaluate(np.stack([u.ravel(), v.ravel()], axis=1)).reshape(height, width, 2).astype(np.float32)
+        return self
+
+    def to_angles(self, points, frame_size=None):
+        """
+        Convert (N, 2) pixel positions from a frame of `frame_size` to (N, 2) integer
+        servo angles, clamped to the servo limits.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if len(points) == 0:
+            return np.empty((0, 2), dtype=np.int32)
+        if frame_size is not None and tuple(frame_size) != self.frame_size:
+            points = points * (np.array(self.frame_size, dtype=np.float64) / np.array(frame_size, dtype=np.float64))
+
+        if self.lut is not None:
+            width, height = self.frame_size
+            x = np.clip(np.rint(points[:, 0]).astype(np.intp), 0, width - 1)
+            y = np.clip(np.rint(points[:, 1]).astype(np.intp), 0, height - 1)
+            angles = self.lut[y, x]
+        else:
+            angles = self.evaluate(points)
+
+        angles = np.rint(angles).astype(np.int32)
+        angles[:, 0] = np.clip(angles[:, 0], *ANGLE_X_RANGE)
+        angles[:, 1] = np.clip(angles[:, 1], *ANGLE_Y_RANGE)
+        return angles
+
+
+def angle_message(angle_x, angle_y):
+    # Serial command for the firmware to point the servos directly, see arduino.ino
+    return f"A{int(angle_x)},{int(angle_y)}\n"
+
+
+def calibrate(port, camera_index=0, output=TARGETING_FILE, degree=2):
+    """
+    Interactive aiming calibration. Jog the turret with W/A/S/D (hold shift for big steps),
+    click where the spray lands in the camera image, press space to store the point.
+    Press F to fit and save, Q to quit without saving.
+    """
+    import serial
+    from supporting.camera_output import get_camera, release_cameras
+
+    esp = serial.Serial(port, 9600, timeout=1)
+    time.sleep(2)
+    camera = get_camera(camera_index)
+
+    angle = [90, 100]
+    clicked = []
+    pixels, angles = [], []
+
+    def on_mouse(event, x, y, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            clicked[:] = [(x, y)]
+
+    cv2.namedWindow("Targeting calibration")
+    cv2.setMouseCallback("Targeting calibration", on_mouse)
+    esp.write(angle_message(*angle).encode())
+
+    frame_size = None
+    steps = {ord('a'): (-1, 0), ord('d'): (1, 0), ord('w'): (0, -1), ord('s'): (0, 1),
+             ord('A'): (-5, 0), ord('D'): (5, 0), ord('W'): (0, -5), ord('S'): (0, 5)}
+    try:
+        while True:
+            latest = camera.latest()
+            if latest is not None:
+                frame = latest[2].copy()
+                frame_size = (frame.shape[1], frame.shape[0])
+                for px, py in pixels:
+                    cv2.circle(frame, (int(px), int(py)), 4, (0, 255, 0), -1)
+                if clicked:
+                    cv2.circle(frame, clicked[0], 6, (0, 0, 255), 2)
+                cv2.putText(frame, f"angles {angle[0]},{angle[1]}  points {len(pixels)}", (10, 25),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+                cv2.imshow("Targeting calibration", frame)
+
+            key = cv2.waitKey(30) & 0xFF
+            if key in steps:
+                angle[0] = int(np.clip(angle[0] + steps[key][0], *ANGLE_X_RANGE))
+                angle[1] = int(np.clip(angle[1] + steps[key][1], *ANGLE_Y_RANGE))
+                esp.write(angle_message(*angle).encode())
+            elif key == ord(' ') and clicked:
+                pixels.append(clicked[0])
+                angles.append(tuple(angle))
+                print(f"Point {len(pixels)}: pixel {clicked[0]} -> angles {angle}")
+                clicked.clear()
+            elif key in (ord('f'), ord('F')):
+                # Keep the session and its points when the fit can not be made yet
+                if frame_size is None:
+                    print("No frame from the camera yet, can not fit")
+                    continue
+                try:
+                    model = TargetingModel.fit(pixels, angles, frame_size, degree)
+                except ValueError as e:
+                    needed = poly_features(np.zeros(1), np.zeros(1), degree).shape[-1]
+                    print(f"{e}, record {needed - len(pixels)} more before fitting")
+                    continue
+                residual = np.sqrt(np.mean((model.evaluate(pixels) - np.asarray(angles)) ** 2))
+                print(f"Fitted degree {degree} over {len(pixels)} points, RMS residual {residual:.2f} deg")
+                model.save(output, residual)
+                return model
+            elif key in (ord('q'), ord('Q')):
+                return None
+    finally:
+        cv2.destroyAllWindows()
+        release_cameras()
+        esp.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pixel to servo angle targeting")
+    parser.add_argument("port", help="Serial port of the ESP8266, e.g. COM11")
+    parser.add_argument("--camera", type=int, default=0, help="Camera index")
+    parser.add_argument("--degree", type=int, default=2, help="Polynomial degree of the fit")
+    parser.add_argument("--output", default=TARGETING_FILE, help="Targeting file to write")
+    args = parser.parse_args()
+
+    if calibrate(args.port, args.camera, args.output, args.degree) is None:
+        sys.exit(1)
@@ -0,0 +1,140 @@
+#Tiled inference for high resolution frames, so small seedlings are not lost when the frame is shrunk to imgsz
+import time
+import argparse
+import cv2
+import numpy as np
+
+from supporting.inference_backends import DEFAULT_CONF
+from supporting.detections import Detections, nms
+
+
+def tile_grid(width, height, tile_size, overlap):
+    """
+    (N, 4) array of x0, y0, x1, y1 tiles covering the frame, neighbours overlapping by
+    `overlap` of the tile size. The last row and column are moved back inside the frame
+    instead of being cut short, so every tile has the full size.
+    """
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        return positions + [length - tile_size]
+
+    xs, ys = starts(width), starts(height)
+    x0, y0 = np.meshgrid(xs, ys)
+    x0, y0 = x0.ravel(), y0.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + tile_size, width), np.minimum(y0 + tile_size, height)], axis=1)
+
+
+def merge_detections(data, threshold=0.5, metric='ios'):
+    """
+    Greedy per-class suppression of the duplicates a weed produces in overlapping tiles.
+    With metric 'ios' the overlap is measured against the smaller box, so the part of a
+    weed cut off at a tile seam is removed even though its IoU with the full box is low.
+    Returns the kept rows of the (N, 6) array by descending score.
+    """
+    if len(data) == 0:
+        return data
+    return data[nms(data[:, :4], data[:, 4], threshold, data[:, 5], metric=metric)]
+
+
+class TiledDetector:
+    """
+    Runs the model over overlapping `tile_size` tiles of a frame, `batch_size` tiles per model
+    call, shifts the boxes back to frame coordinates and merges the duplicates along the seams.
+    With `full_frame` the whole frame is also run once, so weeds larger than a tile are
+    still found in one piece. Called with a frame it returns the merged Detections.
+    """
+
+    def __init__(self, model, tile_size=640, overlap=0.2, batch_size=8, conf=DEFAULT_CONF,
+                 merge_threshold=0.5, metric='ios', full_frame=True):
+        self.model = model
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.conf = conf
+        self.merge_threshold = merge_threshold
+        self.metric = metric
+        self.full_frame = full_frame
+        self.timing = {}
+
+    def __call__(self, frame):
+        h, w = frame.shape[:2]
+        tiles = tile_grid(w, h, self.tile_size, self.overlap)
+        start = time.perf_counter()
+
+        found = []
+        for first in range(0, len(tiles), self.batch_size):
+            batch = tiles[first:first + self.batch_size]
+            # Tiles are views into the frame, nothing is copied before the model letterboxes them
+            crops = [frame[y0:y1, x0:x1] for x0, y0, x1, y1 in batch]
+            results = self.model(crops, imgsz=self.tile_size, conf=self.conf, verbose=False)
+            for (x0, y0, _, _), result in zip(batch, results):
+                found.append(Detections.from_result(result).shift(int(x0), int(y0)).data)
+                names = result.names
+        tiles_done = time.perf_counter()
+
+        if self.full_frame:
+            result = self.model(frame, conf=self.conf, verbose=False)[0]
+            found.append(Detections.from_result(result).data)
+            names = result.names
+        inferred = time.perf_counter()
+
+        data = np.concatenate(found)
+        candidates = len(data)
+        detections = Detections.from_array(merge_detections(data, self.merge_threshold, self.metric), names)
+        done = time.perf_counter()
+
+        self.timing = {
+            'tiles': len(tiles),
+            'tile_ms': (tiles_done - start) * 1000 / len(tiles),
+            'tiles_ms': (tiles_done - start) * 1000,
+            'full_frame_ms': (inferred - tiles_done) * 1000,
+            'merge_ms': (done - inferred) * 1000,
+            'total_ms': (done - start) * 1000,
+            'candidates': candidates,
+            'detections': len(detections),
+        }
+        return detections
+
+    def report(self):
+        t = self.timing
+        if not t:
+            return "No frame processed yet"
+        return (f"{t['tiles']} tiles of {self.tile_size} px ({self.overlap:.0%} overlap, batch {self.batch_size}): "
+                f"{t['tile_ms']:.1f} ms/tile, tiles {t['tiles_ms']:.0f} ms, full frame {t['full_frame_ms']:.0f} ms, "
+                f"merge {t['merge_ms']:.1f} ms, total {t['total_ms']:.0f} ms, "
+                f"{t['candidates']} boxes merged to {t['detections']}")
+
+
+if __name__ == "__main__":
+    from supporting.model_registry import get_model
+
+    parser = argparse.ArgumentParser(description="Tiled detection on a high resolution image")
+    parser.add_argument("image", help="Image to detect on, e.g. a 4608x3456 action camera photo")
+    parser.add_argument("--weights", default='novlast.pt', help="Model weights")
+    parser.add_argument("--tile", type=int, default=640, help="Tile size in pixels")
+    parser.add_argument("--overlap", type=float, default=0.2, help="Overlap between tiles, fraction of the tile size")
+    parser.add_argument("--batch", type=int, default=8, help="Tiles per model call")
+    parser.add_argument("--no-full-frame", action="store_true", help="Skip the extra whole frame pass")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs")
+    parser.add_argument("--show", action="store_true", help="Show the merged detections")
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image)
+    if image is None:
+        raise SystemExit(f"Could not read {args.image}")
+    detector = TiledDetector(get_model(args.weights), args.tile, args.overlap, args.batch,
+                             full_frame=not args.no_full_frame)
+    for _ in range(args.runs):
+        detections = detector(image)
+        print(detector.report())
+
+    if args.show:
+        detections.draw(image, {0: (0, 255, 0), 1: (0, 0, 255)}, thickness=4, font_scale=1.3)
+        scale = 1280 / image.shape[1]
+        cv2.imshow("Tiled detections", cv2.resize(image, None, fx=scale, fy=scale))
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
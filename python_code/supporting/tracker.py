@@ -0,0 +1,210 @@
+#Follows detected plants from frame to frame, so the model only has to run every few frames
+import time
+import cv2
+import numpy as np
+
+from supporting.detections import Detections, box_overlap
+
+
+def greedy_match(affinity, minimum):
+    """
+    Pairs of (row, column) taken by descending affinity, every row and column used once.
+    Pairs below `minimum` are never matched.
+    """
+    rows, cols = np.nonzero(affinity >= minimum)
+    order = np.argsort(-affinity[rows, cols], kind='stable')
+    used_rows, used_cols, pairs = set(), set(), []
+    for r, c in zip(rows[order].tolist(), cols[order].tolist()):
+        if r not in used_rows and c not in used_cols:
+            used_rows.add(r)
+            used_cols.add(c)
+            pairs.append((r, c))
+    return pairs
+
+
+class Tracker:
+    """
+    Gives every detected plant a stable id. `detector(image)` returning Detections runs on
+    every `detect_every`-th frame, or may return None when it has no new detections yet, like
+    the AsyncDetector of the inference pool; the frame is then propagated and it is asked
+    again on the next one. A late result with the `detections` of an earlier `frame`, like
+    the AsyncResult of the AsyncDetector, is first moved to the current frame with optical
+    flow, detections whose flow is lost are dropped. Detections are associated to the tracks by IoU and then by
+    centroid distance, all on NumPy cost matrices. On the frames in between the tracks are
+    moved with Lucas-Kanade optical flow on a small grayscale copy of the frame, or with
+    their last velocity where the flow is lost. Tracks not seen by `max_missed` detector
+    runs in a row are dropped.
+    """
+
+    def __init__(self, detector, detect_every=3, iou_threshold=0.3, max_distance=40,
+                 max_missed=2, flow_width=320, smoothing=0.5):
+        self.detector = detector
+        self.detect_every = detect_every
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_missed = max_missed
+        self.flow_width = flow_width
+        self.smoothing = smoothing
+        self.next_id = 1
+        self.detector_runs = 0
+        self.propagated = 0
+        self.reset()
+
+    def reset(self):
+        self.ids = np.empty(0, dtype=np.int32)
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.scores = np.empty(0, dtype=np.float32)
+        self.classes = np.empty(0, dtype=np.int32)
+        self.velocity = np.empty((0, 2), dtype=np.float32)
+        self.missed = np.empty(0, dtype=np.int32)
+        self.names = {}
+        self.since_detection = 0
+        self.previous_gray = None
+        self.previous_shape = None
+        self.previous_time = None
+
+    def detections(self):
+        # Current track boxes, in the same order as self.ids
+        return Detections(self.boxes, self.scores, self.classes, self.names)
+
+    def step(self, frame, timestamp=None):
+        """
+        Track one frame and return the Detections of the current tracks, ids in self.ids.
+        A frame of another size, like a new zoom level, starts the tracks over.
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if frame.shape != self.previous_shape:
+            self.reset()
+            self.previous_shape = frame.shape
+
+        gray = self.small_gray(frame)
+        detections = None
+        if self.since_detection >= self.detect_every - 1 or self.previous_gray is None:
+            detections = self.detector(frame)
+        if detections is not None and not isinstance(detections, Detections):
+            detections = self.catch_up(detections.detections, detections.frame, gray)
+        if detections is not None:
+            self.predict(timestamp)
+            self.update(detections, timestamp)
+            self.detector_runs += 1
+            self.since_detection = 0
+        else:
+            if self.previous_gray is not None:
+                self.propagate(gray, frame.shape, timestamp)
+            self.propagated += 1
+            self.since_detection += 1
+
+        self.previous_gray = gray
+        self.previous_time = timestamp
+        return self.detections()
+
+    def small_gray(self, frame):
+        scale = min(1.0, self.flow_width / frame.shape[1])
+        small = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1.0 else frame
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def move(self, shift):
+        self.boxes = self.boxes + np.concatenate([shift, shift], axis=1).astype(np.float32)
+
+    def predict(self, timestamp):
+        # Constant velocity step to the time of this frame
+        if self.previous_time is not None and len(self.ids):
+            self.move(self.velocity * (timestamp - self.previous_time))
+
+    def flow(self, previous, current, points):
+        """
+        Lucas-Kanade flow of (N, 1, 2) float32 points, returns (moved, found). A point only
+        counts as found when tracking it back lands within a pixel of where it started,
+        so a jump larger than the flow can follow is not taken as a small move.
+        """
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(previous, current, points, None, winSize=(15, 15), maxLevel=2)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(current, previous, moved, None, winSize=(15, 15), maxLevel=2)
+        error = np.linalg.norm((back - points).reshape(-1, 2), axis=1)
+        found = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < 1.0)
+        return moved, found
+
+    def propagate(self, gray, shape, timestamp):
+        if not len(self.ids):
+            return
+        scale = gray.shape[1] / shape[1]
+        centres = ((self.boxes[:, :2] + self.boxes[:, 2:]) / 2 * scale).astype(np.float32).reshape(-1, 1, 2)
+        moved, found = self.flow(self.previous_gray, gray, centres)
+        dt = timestamp - self.previous_time
+        shift = self.velocity * dt
+        flow = (moved - centres).reshape(-1, 2) / scale
+        shift[found] = flow[found]
+        self.move(shift)
+        if dt > 0:
+            rate = flow[found] / dt
+            self.velocity[found] = self.smoothing * self.velocity[found] + (1 - self.smoothing) * rate
+
+    def catch_up(self, detections, source_frame, gray):
+        # Detections found on `source_frame` moved by the optical flow from it to the current frame
+        if not len(detections):
+            return detections
+        source_gray = self.small_gray(source_frame)
+        scale = gray.shape[1] / source_frame.shape[1]
+        centres = ((detections.xyxy[:, :2] + detections.xyxy[:, 2:]) / 2 * scale).astype(np.float32).reshape(-1, 1, 2)
+        moved, found = self.flow(source_gray, gray, centres)
+        flow = (moved - centres).reshape(-1, 2) / scale
+        xyxy = detections.xyxy + np.concatenate([flow, flow], axis=1).astype(np.float32)
+        return Detections(xyxy[found], detections.score[found], detections.class_id[found], detections.names)
+
+    def update(self, detections, timestamp):
+        self.names = detections.names or self.names
+        n_tracks, n_dets = len(self.ids), len(detections)
+        pairs = []
+        if n_tracks and n_dets:
+            same_class = self.classes[:, None] == detections.class_id[None, :]
+            iou = box_overlap(self.boxes, detections.xyxy) * same_class
+            pairs = greedy_match(iou, self.iou_threshold)
+
+            # Small fast moving plants can lose all overlap, try the remaining ones by centroid distance
+            rows = np.setdiff1d(np.arange(n_tracks), [r for r, _ in pairs])
+            cols = np.setdiff1d(np.arange(n_dets), [c for _, c in pairs])
+            if len(rows) and len(cols):
+                centres = (self.boxes[rows, :2] + self.boxes[rows, 2:]) / 2
+                distance = np.linalg.norm(centres[:, None] - detections.centroid[cols][None].astype(np.float32), axis=2)
+                closeness = (1 - distance / self.max_distance) * same_class[np.ix_(rows, cols)]
+                pairs += [(rows[r], cols[c]) for r, c in greedy_match(closeness, 1e-6)]
+
+        matched_tracks = np.array([r for r, _ in pairs], dtype=np.intp)
+        matched_dets = np.array([c for _, c in pairs], dtype=np.intp)
+
+        if len(pairs):
+            # Correct the velocity by how far the prediction was off, like an alpha-beta filter
+            dt = timestamp - self.previous_time if self.previous_time is not None else 0
+            predicted = (self.boxes[matched_tracks, :2] + self.boxes[matched_tracks, 2:]) / 2
+            measured = (detections.xyxy[matched_dets, :2] + detections.xyxy[matched_dets, 2:]) / 2
+            if dt > 0:
+                self.velocity[matched_tracks] += (1 - self.smoothing) * (measured - predicted) / dt
+            self.boxes[matched_tracks] = detections.xyxy[matched_dets]
+            self.scores[matched_tracks] = detections.score[matched_dets]
+            self.missed[matched_tracks] = 0
+
+        unmatched = np.ones(n_tracks, dtype=bool)
+        unmatched[matched_tracks] = False
+        self.missed[unmatched] += 1
+        alive = self.missed <= self.max_missed
+
+        fresh = np.ones(n_dets, dtype=bool)
+        fresh[matched_dets] = False
+        new_ids = np.arange(self.next_id, self.next_id + fresh.sum(), dtype=np.int32)
+        self.next_id += len(new_ids)
+
+        self.ids = np.concatenate([self.ids[alive], new_ids])
+        self.boxes = np.concatenate([self.boxes[alive], detections.xyxy[fresh]])
+        self.scores = np.concatenate([self.scores[alive], detections.score[fresh]])
+        self.classes = np.concatenate([self.classes[alive], detections.class_id[fresh]])
+        self.velocity = np.concatenate([self.velocity[alive], np.zeros((len(new_ids), 2), dtype=np.float32)])
+        self.missed = np.concatenate([self.missed[alive], np.zeros(len(new_ids), dtype=np.int32)])
+
+    def draw_ids(self, image, color=(255, 255, 255)):
+        for track_id, (x, y) in zip(self.ids.tolist(), self.detections().centroid.tolist()):
+            cv2.putText(image, f"#{track_id}", (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+        return image
+
+    def summary(self):
+        total = self.detector_runs + self.propagated
+        return (f"Tracker: {len(self.ids)} tracks, model ran on {self.detector_runs} of {total} frames, "
+                f"{self.next_id - 1} ids given out")
@@ -0,0 +1,125 @@
+#Region of the frame the spray turret can reach, only this part is sent to the model
+import json
+import cv2
+import numpy as np
+
+WORK_AREA_FILE = 'work_area.json'
+
+# Fill value for masked pixels, the same grey Ultralytics pads the letterbox with
+MASK_FILL = 114
+
+
+class WorkArea:
+    """
+    Rectangle of `width` x `height` pixels centred in the frame, a size of 0 keeps the full
+    frame in that direction. An optional polygon in the pixels of a `frame_size` frame narrows
+    it further: pixels outside it are greyed out before inference and detections whose
+    centroid falls outside it are dropped. Sizes are scaled to frames of another resolution.
+    """
+
+    def __init__(self, width=0, height=0, polygon=None, frame_size=(640, 480)):
+        self.width = int(width)
+        self.height = int(height)
+        self.polygon = None if polygon is None else np.asarray(polygon, dtype=np.float32).reshape(-1, 2)
+        self.frame_size = tuple(frame_size)
+        self.masks = {}
+
+    @classmethod
+    def load(cls, path=WORK_AREA_FILE):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls()
+        return cls(data.get('width', 0), data.get('height', 0), data.get('polygon'), data.get('frame_size', (640, 480)))
+
+    def save(self, path=WORK_AREA_FILE):
+        data = {'width': self.width, 'height': self.height, 'frame_size': list(self.frame_size)}
+        if self.polygon is not None:
+            data['polygon'] = self.polygon.tolist()
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2)
+
+    def is_full_frame(self):
+        return self.width <= 0 and self.height <= 0 and self.polygon is None
+
+    def rect_for(self, frame_width, frame_height):
+        # (x0, y0, x1, y1) of the area in a frame of this size
+        sx, sy = frame_width / self.frame_size[0], frame_height / self.frame_size[1]
+        w = min(frame_width, int(round(self.width * sx))) if self.width > 0 else frame_width
+        h = min(frame_height, int(round(self.height * sy))) if self.height > 0 else frame_height
+        x0, y0 = (frame_width - w) // 2, (frame_height - h) // 2
+        if self.polygon is not None:
+            # Shrink the rectangle to the polygon, pixels outside it are never inferred on
+            px, py, pw, ph = cv2.boundingRect(self.polygon_for(frame_width, frame_height).astype(np.int32))
+            x1, y1 = min(x0 + w, px + pw), min(y0 + h, py + ph)
+            x0, y0 = max(x0, px), max(y0, py)
+            w, h = x1 - x0, y1 - y0
+        return x0, y0, x0 + max(w, 0), y0 + max(h, 0)
+
+    def polygon_for(self, frame_width, frame_height):
+        scale = np.array([frame_width / self.frame_size[0], frame_height / self.frame_size[1]], dtype=np.float32)
+        return self.polygon * scale
+
+    def mask_for(self, frame_width, frame_height):
+        # Full-frame polygon mask, built once per frame size
+        mask = self.masks.get((frame_width, frame_height))
+        if mask is None:
+            mask = np.zeros((frame_height, frame_width), dtype=np.uint8)
+            cv2.fillPoly(mask, [np.rint(self.polygon_for(frame_width, frame_height)).astype(np.int32)], 1)
+            self.masks[(frame_width, frame_height)] = mask
+        return mask
+
+    def crop(self, frame, pool=None):
+        """
+        Return (crop, (x0, y0)) of the area, add (x0, y0) to positions found in the crop to get
+        full-frame coordinates. Without a polygon the crop is a view of the frame, with one
+        the masked copy is written to a `pool` buffer when given. When the rectangle and the
+        polygon do not overlap the crop is empty, check crop.size before running the model.
+        """
+        height, width = frame.shape[:2]
+        if self.is_full_frame():
+            return frame, (0, 0)
+        x0, y0, x1, y1 = self.rect_for(width, height)
+        crop = frame[y0:y1, x0:x1]
+        if self.polygon is None or crop.size == 0:
+            return crop, (x0, y0)
+
+        mask = self.mask_for(width, height)[y0:y1, x0:x1]
+        out = pool.like("work_area", crop) if pool is not None else np.empty_like(crop)
+        out[...] = MASK_FILL
+        np.copyto(out, crop, where=mask[..., None].astype(bool))
+        return out, (x0, y0)
+
+    def contains(self, points, frame_width, frame_height):
+        # Boolean mask of the (N, 2) full-frame points that lie inside the area
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        x0, y0, x1, y1 = self.rect_for(frame_width, frame_height)
+        x = np.rint(points[:, 0]).astype(np.intp)
+        y = np.rint(points[:, 1]).astype(np.intp)
+        inside = (x >= x0) & (x < x1) & (y >= y0) & (y < y1)
+        if self.polygon is not None:
+            mask = self.mask_for(frame_width, frame_height)
+            inside[inside] = mask[y[inside], x[inside]] > 0
+        return inside
+
+    def to_frame(self, detections, offset, frame_width, frame_height):
+        """
+        Shift the Detections of a crop by the crop `offset` and keep only those whose centroid
+        is inside the area, so masked corners never produce targets.
+        """
+        detections = detections.shift(*offset)
+        if self.polygon is not None:
+            detections = detections[self.contains(detections.centroid, frame_width, frame_height)]
+        return detections
+
+    def draw(self, image, color=(255, 200, 0)):
+        # Outline of the area on a full-frame image
+        height, width = image.shape[:2]
+        if self.is_full_frame():
+            return image
+        x0, y0, x1, y1 = self.rect_for(width, height)
+        cv2.rectangle(image, (x0, y0), (x1 - 1, y1 - 1), color, 2)
+        if self.polygon is not None:
+            cv2.polylines(image, [np.rint(self.polygon_for(width, height)).astype(np.int32)], True, color, 2)
+        return image